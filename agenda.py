@@ -0,0 +1,111 @@
+from bisect import bisect_right
+from datetime import datetime, timedelta
+from sqlalchemy import text
+from database import db, Agendamento
+from cache_local import CacheLRU
+from cache_paginas import cache_paginas
+from cache_catalogo import cache_catalogo
+from duracoes import duracoes_p50
+
+# ---------------------------
+# AGENDA: CAPACIDADE DOS BOXES E HORÁRIOS LIVRES
+# ---------------------------
+# Cada agendamento ocupa um box de data_agendada até data_agendada + duração típica do serviço
+# (mediana de tempo_inicio/tempo_fim, ver duracoes.py). Um horário é aceito se, em nenhum instante do
+# intervalo, a ocupação chega ao número de boxes configurado.
+
+CHAVE_TRAVA_AGENDA = 20260215
+
+_cache_duracoes = CacheLRU(tamanho_maximo=1, ttl_segundos=600)
+
+class HorarioIndisponivel(ValueError):
+    pass
+
+class IndiceIntervalos:
+    """Inícios e fins ordenados dos intervalos [inicio, fim) de um dia; consultas por busca binária."""
+
+    def __init__(self, intervalos):
+        self.inicios = sorted(inicio for inicio, _ in intervalos)
+        self.fins = sorted(fim for _, fim in intervalos)
+
+    def ocupacao_maxima(self, inicio, fim):
+        """Maior número de intervalos simultâneos dentro de [inicio, fim)."""
+        i = bisect_right(self.inicios, inicio)
+        j = bisect_right(self.fins, inicio)
+        ativos = maximo = i - j
+        # Só os eventos dentro da janela são percorridos; fins antes de inícios no mesmo instante
+        while i < len(self.inicios) and self.inicios[i] < fim:
+            while j < len(self.fins) and self.fins[j] <= self.inicios[i]:
+                ativos -= 1
+                j += 1
+            ativos += 1
+            i += 1
+            maximo = max(maximo, ativos)
+        return maximo
+
+def duracoes_servicos():
+    """Mediana em minutos de cada serviço já realizado; recarregada quando as estatísticas mudam."""
+    versao = cache_paginas.versoes(['estatistica_duracao'])[0]
+    duracoes = _cache_duracoes.obter(versao)
+    if duracoes is None:
+        duracoes = duracoes_p50()
+        _cache_duracoes.guardar(versao, duracoes)
+    return duracoes
+
+def duracao_servico(nome_servico, config):
+    return timedelta(minutes=duracoes_servicos().get(nome_servico) or config.duracao_padrao_minutos or 60)
+
+def _horario(valor, padrao):
+    try:
+        return datetime.strptime(valor, '%H:%M').time()
+    except (TypeError, ValueError):
+        return padrao
+
+def indice_do_dia(dia, config, ignorar_id=None):
+    inicio = datetime.combine(dia, datetime.min.time())
+    consulta = db.session.query(Agendamento.data_agendada, Agendamento.tipo_servico).filter(
+        Agendamento.data_agendada >= inicio,
+        Agendamento.data_agendada < inicio + timedelta(days=1),
+        Agendamento.status != 'Cancelado'
+    )
+    if ignorar_id:
+        consulta = consulta.filter(Agendamento.id != ignorar_id)
+    return IndiceIntervalos([(data, data + duracao_servico(servico, config)) for data, servico in consulta])
+
+def _travar_dia(dia):
+    # Postgres: serializa as reservas do mesmo dia entre workers até o fim da transação
+    if db.engine.dialect.name == 'postgresql':
+        db.session.execute(text("SELECT pg_advisory_xact_lock(:chave, :dia)"), {'chave': CHAVE_TRAVA_AGENDA, 'dia': dia.toordinal()})
+
+def verificar_disponibilidade(data_agendada, tipo_servico, ignorar_id=None):
+    """Levanta HorarioIndisponivel se, em algum instante do serviço, todos os boxes estão ocupados."""
+    config = cache_catalogo.config()
+    if config is None:
+        return
+    _travar_dia(data_agendada.date())
+
+    fim = data_agendada + duracao_servico(tipo_servico, config)
+    boxes = config.boxes_lavagem or 1
+    if indice_do_dia(data_agendada.date(), config, ignorar_id).ocupacao_maxima(data_agendada, fim) >= boxes:
+        raise HorarioIndisponivel(f'Horário indisponível: os {boxes} box(es) já estão ocupados entre '
+                                  f'{data_agendada.strftime("%H:%M")} e {fim.strftime("%H:%M")}.')
+
+def slots_do_dia(dia, tipo_servico=None):
+    """Horários de início do expediente com a quantidade de boxes livres para o serviço informado."""
+    config = cache_catalogo.config()
+    if config is None:
+        return []
+    duracao = duracao_servico(tipo_servico, config)
+    boxes = config.boxes_lavagem or 1
+    passo = timedelta(minutes=config.intervalo_slots_minutos or 30)
+    abertura = datetime.combine(dia, _horario(config.horario_abertura, datetime.strptime('08:00', '%H:%M').time()))
+    fechamento = datetime.combine(dia, _horario(config.horario_fechamento, datetime.strptime('18:00', '%H:%M').time()))
+
+    indice = indice_do_dia(dia, config)
+    slots = []
+    inicio = abertura
+    while inicio + duracao <= fechamento:
+        vagas = max(boxes - indice.ocupacao_maxima(inicio, inicio + duracao), 0)
+        slots.append({'hora': inicio.strftime('%H:%M'), 'vagas': vagas, 'livre': vagas > 0})
+        inicio += passo
+    return slots
@@ -0,0 +1,100 @@
+from sqlalchemy import func, case, select, update, bindparam, or_
+from database import db, STATUS_CONCLUIDOS, Cliente, Agendamento
+
+# ---------------------------
+# AGREGADOS POR CLIENTE (lavagens, canceladas, total gasto, última visita)
+# ---------------------------
+# Mantidos na própria linha do cliente com UPDATEs relativos na mesma transação da mudança de
+# status, então a tela de clientes só lê colunas e ordena pelo índice ix_clientes_ranking.
+
+def _contribuicao(status, valor):
+    concluido = status in STATUS_CONCLUIDOS
+    return (1 if concluido else 0, 1 if status == 'Cancelado' else 0, (valor or 0.0) if concluido else 0.0)
+
+def _ultima_visita(cliente_id, ignorar_id=None):
+    consulta = select(func.max(Agendamento.data_agendada)).where(
+        Agendamento.cliente_id == cliente_id,
+        Agendamento.status.in_(STATUS_CONCLUIDOS)
+    )
+    if ignorar_id:
+        consulta = consulta.where(Agendamento.id != ignorar_id)
+    return consulta.scalar_subquery()
+
+def registrar_mudanca_status(agendamento, status_anterior, removido=False):
+    """Aplica ao cliente a diferença entre o status anterior e o atual (removido: o agendamento será excluído).
+    O commit fica com quem chamou."""
+    antes = _contribuicao(status_anterior, agendamento.valor_cobrado)
+    depois = (0, 0, 0.0) if removido else _contribuicao(agendamento.status, agendamento.valor_cobrado)
+    lavagens, canceladas, gasto = (d - a for d, a in zip(depois, antes))
+    if not (lavagens or canceladas or gasto):
+        return
+
+    valores = {
+        Cliente.qtd_lavagens: func.coalesce(Cliente.qtd_lavagens, 0) + lavagens,
+        Cliente.qtd_canceladas: func.coalesce(Cliente.qtd_canceladas, 0) + canceladas,
+        Cliente.total_gasto: func.coalesce(Cliente.total_gasto, 0.0) + gasto
+    }
+    if lavagens > 0:
+        data = agendamento.data_agendada
+        valores[Cliente.ultima_visita] = case(
+            (or_(Cliente.ultima_visita.is_(None), Cliente.ultima_visita < data), data),
+            else_=Cliente.ultima_visita
+        )
+    elif lavagens < 0:
+        valores[Cliente.ultima_visita] = _ultima_visita(agendamento.cliente_id, ignorar_id=agendamento.id)
+
+    db.session.execute(update(Cliente).where(Cliente.id == agendamento.cliente_id).values(valores))
+
+def somar_agendamentos_importados(agendamentos):
+    """Soma aos agregados um lote de agendamentos inseridos em massa: [(cliente_id, status, valor, data)].
+    Um UPDATE relativo por cliente em um único executemany. O commit fica com quem chamou."""
+    deltas = {}
+    for cliente_id, status, valor, data in agendamentos:
+        lavagens, canceladas, gasto = _contribuicao(status, valor)
+        atual = deltas.setdefault(cliente_id, {'id_': cliente_id, 'l': 0, 'c': 0, 'g': 0.0, 'u': None})
+        atual['l'] += lavagens
+        atual['c'] += canceladas
+        atual['g'] += gasto
+        if lavagens and (atual['u'] is None or data > atual['u']):
+            atual['u'] = data
+    if not deltas:
+        return
+
+    tabela = Cliente.__table__
+    ultima = bindparam('u', type_=db.DateTime)
+    db.session.execute(update(tabela).where(tabela.c.id == bindparam('id_')).values(
+        qtd_lavagens=func.coalesce(tabela.c.qtd_lavagens, 0) + bindparam('l'),
+        qtd_canceladas=func.coalesce(tabela.c.qtd_canceladas, 0) + bindparam('c'),
+        total_gasto=func.coalesce(tabela.c.total_gasto, 0.0) + bindparam('g'),
+        ultima_visita=case((or_(tabela.c.ultima_visita.is_(None), tabela.c.ultima_visita < ultima), ultima), else_=tabela.c.ultima_visita)
+    ), list(deltas.values()))
+
+def recalcular_ultima_visita(cliente_id):
+    """Usado quando a data de uma lavagem já concluída é editada."""
+    db.session.execute(update(Cliente).where(Cliente.id == cliente_id).values(ultima_visita=_ultima_visita(cliente_id)))
+
+def consulta_agregados_reais():
+    """Agregados recalculados a partir dos agendamentos: (cliente_id, lavagens, canceladas, gasto, ultima_visita)."""
+    concluido = Agendamento.status.in_(STATUS_CONCLUIDOS)
+    return select(
+        Agendamento.cliente_id,
+        func.sum(case((concluido, 1), else_=0)),
+        func.sum(case((Agendamento.status == 'Cancelado', 1), else_=0)),
+        func.sum(case((concluido, Agendamento.valor_cobrado), else_=0.0)),
+        func.max(case((concluido, Agendamento.data_agendada), else_=None))
+    ).group_by(Agendamento.cliente_id)
+
+def reconstruir_agregados_clientes():
+    """Confere os agregados de todos os clientes com os agendamentos e corrige os divergentes.
+    Retorna [(cliente_id, nome, armazenado, real)] das divergências encontradas."""
+    reais = {linha[0]: tuple(linha[1:]) for linha in db.session.execute(consulta_agregados_reais())}
+    divergencias = []
+    for cliente in Cliente.query.order_by(Cliente.id):
+        lavagens, canceladas, gasto, ultima = reais.get(cliente.id, (0, 0, 0.0, None))
+        real = (int(lavagens or 0), int(canceladas or 0), round(gasto or 0.0, 2), ultima)
+        armazenado = (cliente.qtd_lavagens or 0, cliente.qtd_canceladas or 0, round(cliente.total_gasto or 0.0, 2), cliente.ultima_visita)
+        if armazenado != real:
+            divergencias.append((cliente.id, cliente.nome, armazenado, real))
+            cliente.qtd_lavagens, cliente.qtd_canceladas, cliente.total_gasto, cliente.ultima_visita = real[0], real[1], gasto or 0.0, ultima
+    db.session.commit()
+    return divergencias
@@ -1,12 +1,31 @@
 import os
 import locale
 import math
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
-from werkzeug.utils import secure_filename
-from datetime import datetime, date, timedelta
-from sqlalchemy import text
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_from_directory, Response, stream_with_context
+from datetime import datetime, date
+from sqlalchemy import func, event
+from sqlalchemy.orm import selectinload, joinedload
 from urllib.parse import unquote
-from database import db, Cliente, Moto, Agendamento, Produto, MidiaAgendamento, Servico, ConfiguracaoFinanceira, FechamentoMensal
+from database import db, STATUS_CONCLUIDOS, Cliente, Moto, Agendamento, Produto, MidiaAgendamento, Servico, ConfiguracaoFinanceira, FechamentoMensal
+from relatorios import totais_ciclo, linhas_dre
+from ciclo_financeiro import get_mes_anterior, obter_ciclo_atual, limites_ciclo, configurar_feriados
+from fechamentos import processar_fechamentos_pendentes, obter_ultimo_fechamento, iniciar_agendador_fechamentos
+from migracoes import aplicar_migracoes
+from catalogo import semear_catalogo, ressincronizar_catalogo
+from cache_local import CacheLRU
+from cache_paginas import cache_paginas
+from cache_catalogo import cache_catalogo, altera_custo_receita, consultar_servico
+from previsao_estoque import prever_estoque, alertas_reposicao
+from agregados_clientes import registrar_mudanca_status, recalcular_ultima_visita, reconstruir_agregados_clientes
+from indicacoes import registrar_primeira_lavagem, subarvore_indicacoes, resumo_indicacoes
+from planilhas import ler_planilha, gerar_csv, linhas_dre_csv, IMPORTADORES, EXPORTACOES, COLUNAS_DRE, PlanilhaInvalida
+from duracoes import registrar_duracao, duracao_media_geral
+from agenda import verificar_disponibilidade, slots_do_dia, HorarioIndisponivel
+from estoque import baixar_receita, definir_saldo, registrar_compra, compactar_estoque, saldos_no_fim_do_dia
+from busca_clientes import buscar_clientes
+from midias import salvar_upload_midia, UploadInvalido
+from fila_midias import fila_midias, processar_pendentes
+from armazenamento import configurar_armazenamento, obter_armazenamento, CACHE_CONTROL_IMUTAVEL, CACHE_CONTROL_LINK_TEMPORARIO
 
 app = Flask(__name__)
 
@@ -22,304 +41,138 @@ app.config['UPLOAD_FOLDER'] = 'static/uploads'
 # Aumenta o limite de upload do Flask para 64MB
 app.config['MAX_CONTENT_LENGTH'] = 64 * 1024 * 1024 
 
+# --- Armazenamento de Mídia ---
+# 'local' grava em UPLOAD_FOLDER; 's3' usa um bucket compatível (S3_ENDPOINT_URL aponta para MinIO/R2 etc.)
+app.config['ARMAZENAMENTO'] = os.environ.get('ARMAZENAMENTO', 'local')
+configurar_armazenamento(
+    app.config['ARMAZENAMENTO'],
+    app.config['UPLOAD_FOLDER'],
+    bucket=os.environ.get('S3_BUCKET'),
+    prefixo=os.environ.get('S3_PREFIXO', ''),
+    endpoint_url=os.environ.get('S3_ENDPOINT_URL'),
+    url_publica=os.environ.get('S3_URL_PUBLICA')
+)
+
+# --- Calendário do Ciclo Financeiro ---
+# Feriados extras sem expediente bancário (Ex: '2026-01-20,2026-03-19'); os nacionais já são considerados
+app.config['FERIADOS_BANCARIOS'] = os.environ.get('FERIADOS_BANCARIOS', '')
+app.config['FERIADOS_NACIONAIS'] = os.environ.get('FERIADOS_NACIONAIS', '1') != '0'
+configurar_feriados(app.config['FERIADOS_BANCARIOS'], nacionais=app.config['FERIADOS_NACIONAIS'])
+
 db.init_app(app)
 
-# --- FUNÇÃO DE MIGRAÇÃO AUTOMÁTICA (CORREÇÃO DE BANCO) ---
-def verificar_migracoes_banco():
-    with app.app_context():
-        try:
-            with db.engine.connect() as conn:
-                # 1. Migrações de CLIENTES
-                colunas_clientes = [
-                    ("qtd_descontos", "INTEGER DEFAULT 0"),
-                    ("preferencias", "TEXT"),
-                    ("feedback_texto", "TEXT"),
-                    ("feedback_estrelas", "INTEGER DEFAULT 0"),
-                    ("indicado_por_id", "INTEGER")
-                ]
-                for col, tipo in colunas_clientes:
-                    try:
-                        conn.execute(text(f"ALTER TABLE clientes ADD COLUMN {col} {tipo}"))
-                        conn.commit()
-                    except Exception:
-                        conn.rollback()
-
-                # 2. Migrações de PRODUTOS
-                try:
-                    conn.execute(text("ALTER TABLE produtos ADD COLUMN link_compra TEXT"))
-                    conn.commit()
-                except Exception:
-                    conn.rollback()
-
-                # 3. Migrações de AGENDAMENTOS
-                colunas_agendamentos = [
-                    ("forma_pagamento_prevista", "VARCHAR(50)"),
-                    ("forma_pagamento_real", "VARCHAR(50)"),
-                    ("parcelas", "INTEGER DEFAULT 1"),
-                    ("taxa_aplicada", "FLOAT DEFAULT 0.0"),
-                    ("valor_liquido", "FLOAT")
-                ]
-                for col, tipo in colunas_agendamentos:
-                    try:
-                        conn.execute(text(f"ALTER TABLE agendamentos ADD COLUMN {col} {tipo}"))
-                        conn.commit()
-                    except Exception:
-                        conn.rollback()
-
-                # 4. Migrações CONFIGURACAO FINANCEIRA (Gestão Patrimonial)
-                colunas_config = [
-                    ("aporte_erick", "FLOAT DEFAULT 0.0"),
-                    ("aporte_andrei", "FLOAT DEFAULT 0.0"),
-                    ("capex_produtos", "FLOAT DEFAULT 0.0"),
-                    ("capex_ferramentas", "FLOAT DEFAULT 0.0"),
-                    ("capex_estrutura", "FLOAT DEFAULT 0.0"),
-                    ("capex_marketing", "FLOAT DEFAULT 0.0"),
-                    ("capex_outros", "FLOAT DEFAULT 0.0")
-                ]
-                for col, tipo in colunas_config:
-                    try:
-                        conn.execute(text(f"ALTER TABLE configuracao_financeira ADD COLUMN {col} {tipo}"))
-                        conn.commit()
-                    except Exception:
-                        conn.rollback()
-
-                # 5. Migrações FECHAMENTO MENSAL (Retiradas)
-                try:
-                    conn.execute(text("ALTER TABLE fechamento_mensal ADD COLUMN retiradas_extras FLOAT DEFAULT 0.0"))
-                    conn.commit()
-                except Exception:
-                    conn.rollback()
-
-                # 6. Migrações SERVIÇOS (Descrição)
-                try:
-                    conn.execute(text("ALTER TABLE servicos ADD COLUMN descricao TEXT"))
-                    conn.commit()
-                except Exception:
-                    conn.rollback()
-                        
-        except Exception as e:
-            print(f"Erro ao verificar migrações: {e}")
-
-# --- FUNÇÕES DE CICLO FINANCEIRO ---
-def get_quarto_dia_util(ano, mes):
-    dias_uteis = 0
-    dia = 1
-    while dias_uteis < 4:
-        dt = date(ano, mes, dia)
-        if dt.weekday() < 5: # 0 a 4 são Segunda a Sexta
-            dias_uteis += 1
-        if dias_uteis < 4:
-            dia += 1
-    return date(ano, mes, dia)
-
-def get_mes_anterior(ano, mes):
-    if mes == 1: return ano - 1, 12
-    return ano, mes - 1
-
-def get_proximo_mes(ano, mes):
-    if mes == 12: return ano + 1, 1
-    return ano, mes + 1
-    
-def obter_ciclo_atual(data_ref=None):
-    if not data_ref:
-        data_ref = datetime.now().date()
-        
-    quarto_dia_atual = get_quarto_dia_util(data_ref.year, data_ref.month)
-    
-    if data_ref <= quarto_dia_atual:
-        ano_ant, mes_ant = get_mes_anterior(data_ref.year, data_ref.month)
-        quarto_dia_ant = get_quarto_dia_util(ano_ant, mes_ant)
-        
-        data_inicio = quarto_dia_ant + timedelta(days=1)
-        data_fim = quarto_dia_atual
-        mes_referencia = f"{ano_ant}-{mes_ant:02d}"
-        mes_anterior_str = f"{get_mes_anterior(ano_ant, mes_ant)[0]}-{get_mes_anterior(ano_ant, mes_ant)[1]:02d}"
-    else:
-        ano_prox, mes_prox = get_proximo_mes(data_ref.year, data_ref.month)
-        quarto_dia_prox = get_quarto_dia_util(ano_prox, mes_prox)
-        
-        data_inicio = quarto_dia_atual + timedelta(days=1)
-        data_fim = quarto_dia_prox
-        mes_referencia = f"{data_ref.year}-{data_ref.month:02d}"
-        mes_anterior_str = f"{get_mes_anterior(data_ref.year, data_ref.month)[0]}-{get_mes_anterior(data_ref.year, data_ref.month)[1]:02d}"
-        
-    return data_inicio, data_fim, mes_referencia, mes_anterior_str
-    
-def processar_fechamentos_pendentes():
-    try:
-        _, _, _, mes_anterior_str = obter_ciclo_atual()
-        fechamento_ant = FechamentoMensal.query.filter_by(mes_ano=mes_anterior_str).first()
-        
-        if not fechamento_ant:
-            ano_str, mes_str = map(int, mes_anterior_str.split('-'))
-            ano_prox, mes_prox = get_proximo_mes(ano_str, mes_str)
-            
-            q_dia_inicio = get_quarto_dia_util(ano_str, mes_str)
-            q_dia_fim = get_quarto_dia_util(ano_prox, mes_prox)
-            
-            inicio_ciclo = q_dia_inicio + timedelta(days=1)
-            fim_ciclo = q_dia_fim
-            
-            concluidos = Agendamento.query.filter(
-                Agendamento.data_agendada >= datetime.combine(inicio_ciclo, datetime.min.time()),
-                Agendamento.data_agendada <= datetime.combine(fim_ciclo, datetime.max.time()),
-                Agendamento.status.in_(['Lavagem Concluída', 'Retirado'])
-            ).all()
-            
-            fat_liq = sum(a.valor_liquido if a.valor_liquido else a.valor_cobrado for a in concluidos)
-            custo_prod = sum(a.custo_total_produtos for a in concluidos)
-            custo_var_extras = sum(a.gastos_extras for a in concluidos)
-            
-            config = ConfiguracaoFinanceira.query.first()
-            custos_fixos_base = config.aluguel_iptu + config.pro_labore + config.agua_energia_base + config.internet_telefone + config.mei_impostos + config.marketing + config.seguro if config else 0
-            
-            ano_ant_ant, mes_ant_ant = get_mes_anterior(ano_str, mes_str)
-            mes_ant_ant_str = f"{ano_ant_ant}-{mes_ant_ant:02d}"
-            fechamento_ant_ant = FechamentoMensal.query.filter_by(mes_ano=mes_ant_ant_str).first()
-            deficit_ant = abs(fechamento_ant_ant.deficit_acumulado) if fechamento_ant_ant and fechamento_ant_ant.deficit_acumulado < 0 else 0
-            
-            custos_totais = custos_fixos_base + custo_prod + custo_var_extras + deficit_ant
-            lucro_real = fat_liq - custos_totais
-            novo_deficit = lucro_real if lucro_real < 0 else 0
-            
-            novo_fechamento = FechamentoMensal(
-                mes_ano=mes_anterior_str,
-                total_faturado=fat_liq,
-                custos_totais=custos_totais,
-                lucro_real=lucro_real,
-                deficit_acumulado=novo_deficit,
-                retiradas_extras=0.0 # Inicializa com zero
-            )
-            db.session.add(novo_fechamento)
-            db.session.commit()
-    except Exception as e:
-        print(f"Erro ao processar fechamentos pendentes: {e}")
+with app.app_context():
+    db.create_all()
+    aplicar_migracoes()
+    semear_catalogo()
+    # Fechamento e foto do estoque ficam com o agendador e os comandos `flask fechar-meses`/`compactar-estoque`;
+    # FECHAMENTO_NO_BOOT=1 os roda também na partida (deploy serverless sem cron, ao custo de um boot mais lento)
+    if os.environ.get('FECHAMENTO_NO_BOOT') == '1':
+        processar_fechamentos_pendentes()
+        compactar_estoque()
 
-def inicializar_configuracoes_financeiras():
-    try:
-        if ConfiguracaoFinanceira.query.first() is None:
-            nova_config = ConfiguracaoFinanceira()
-            db.session.add(nova_config)
-            db.session.commit()
-            print("--- Configurações Financeiras Iniciais Criadas ---")
-    except Exception as e:
-        print(f"Erro ao inicializar configurações financeiras: {e}")
+# Pós-processamento de mídia em threads; no Vercel (sem trabalho após a resposta) cada upload é processado na
+# própria requisição e o que sobrar na fila fica para o comando `flask processar-midias` via cron
+fila_midias.iniciar(app, int(os.environ.get('MIDIA_WORKERS', '0' if os.environ.get('VERCEL') else '2')))
+with app.app_context():
+    fila_midias.retomar_pendentes()
 
-def inicializar_produtos_padrao():
-    try:
-        produtos_iniciais = [
-            ("Moto-V", "ml", 10.0, 64.50, 500.0),
-            ("Rexer", "ml", 30.0, 54.90, 500.0),
-            ("V-Mol", "ml", 10.0, 94.03, 500.0),
-            ("V-Floc", "ml", 5.0, 114.90, 500.0),
-            ("Vexus", "ml", 25.0, 81.90, 500.0),
-            ("Sintra Fast", "ml", 15.0, 80.70, 500.0),
-            ("Izer", "ml", 30.0, 122.90, 500.0),
-            ("Strike", "ml", 5.0, 130.00, 500.0),
-            ("Delet", "ml", 20.0, 92.30, 500.0),
-            ("V-Bar", "g", 2.0, 20.00, 50.0),
-            ("V-Lub", "ml", 40.0, 20.00, 500.0),
-            ("Revelax", "ml", 20.0, 95.90, 500.0),
-            ("V-Polish", "ml", 10.0, 115.20, 500.0),
-            ("Blend (Spray)", "ml", 10.0, 47.93, 500.0),
-            ("Native (Paste)", "g", 3.0, 54.00, 100.0),
-            ("Tok Final", "ml", 15.0, 25.30, 500.0),
-            ("V-80", "ml", 10.0, 55.80, 500.0),
-            ("SIO2-PRO", "ml", 10.0, 43.90, 500.0),
-            ("Verniz Motor", "ml", 40.0, 89.50, 500.0),
-            ("Verom", "ml", 30.0, 75.79, 500.0),
-            ("Restaurax", "ml", 10.0, 115.90, 500.0),
-            ("Revox", "ml", 5.0, 42.50, 500.0),
-            ("Shiny", "ml", 5.0, 151.00, 500.0),
-            ("Glazy", "ml", 10.0, 27.76, 500.0),
-            ("Prizm", "ml", 5.0, 33.00, 500.0),
-            ("Aquaglass", "ml", 3.0, 30.00, 50.0),
-            ("V-Paint", "ml", 10.0, 74.30, 50.0),
-            ("V-Plastic", "ml", 10.0, 63.90, 50.0),
-            ("V-Energy", "ml", 5.0, 125.50, 50.0),
-            ("V-Light", "ml", 2.0, 61.50, 50.0),
-            ("V-Leather", "ml", 5.0, 138.90, 50.0),
-            ("V-Wheels", "ml", 10.0, 50.00, 50.0),
-            ("Ziva", "ml", 10.0, 50.00, 50.0)
-        ]
-        
-        count_novos = 0
-        for core_nome, un, gasto, custo, qtd in produtos_iniciais:
-            produto_existente = Produto.query.filter(Produto.nome.ilike(f"{core_nome}%")).first()
-            if not produto_existente:
-                novo = Produto(
-                    nome=core_nome, unidade_medida=un, estoque_atual=0.0,
-                    custo_compra=custo, quantidade_compra=qtd, 
-                    gasto_medio_lavagem=gasto, ponto_pedido=5.0, link_compra=""
-                )
-                db.session.add(novo)
-                count_novos += 1
-            else:
-                produto_existente.nome = core_nome
-                produto_existente.custo_compra = custo
-                produto_existente.quantidade_compra = qtd
-                produto_existente.gasto_medio_lavagem = gasto
-        
-        db.session.commit()
-        if count_novos > 0:
-            print(f"--- {count_novos} Produtos Iniciais Cadastrados/Atualizados ---")
-            
-    except Exception as e:
-        print(f"Erro ao inicializar produtos: {e}")
+# Agendador em processo para servidores de longa duração; no Vercel use o comando `flask fechar-meses` via cron
+intervalo_fechamento = int(os.environ.get('FECHAMENTO_INTERVALO_MINUTOS', '60'))
+if intervalo_fechamento > 0 and not os.environ.get('VERCEL'):
+    iniciar_agendador_fechamentos(app, intervalo_fechamento)
 
-def inicializar_servicos_padrao():
-    try:
-        # Pega a base de produtos atualizada para vincular aos serviços
-        todos_produtos = Produto.query.all()
-        vitrificadores_nomes = ['V-Paint', 'V-Plastic', 'V-Energy', 'V-Light', 'V-Leather']
-        prods_standard = [p for p in todos_produtos if p.nome not in vitrificadores_nomes]
-        prods_premium = todos_produtos
-
-        if Servico.query.first() is None:
-            padroes = [
-                ('Naked', 'Standard Naked', 50.00, 'Lavagem detalhada básica'), 
-                ('Naked', 'Premium Naked', 90.00, 'Lavagem com enceramento e proteção vitrificada'),
-                ('Sport', 'Standard Sport', 70.00, 'Lavagem detalhada básica'), 
-                ('Sport', 'Premium Sport', 120.00, 'Lavagem com enceramento e proteção vitrificada'),
-                ('Custom', 'Standard Custom', 80.00, 'Lavagem detalhada básica com polimento de cromados leves'), 
-                ('Custom', 'Premium Custom', 150.00, 'Lavagem completa com proteção avançada de metais e vitrificadores'),
-                ('BigTrail', 'Standard Trail', 60.00, 'Lavagem para remoção de terra e barro leve'), 
-                ('BigTrail', 'Premium Trail', 110.00, 'Lavagem profunda desincrustante e proteção plástica premium')
-            ]
-            for cat, nome, valor, desc in padroes:
-                novo_servico = Servico(categoria=cat, nome=nome, valor=valor, descricao=desc)
-                if 'Standard' in nome:
-                    novo_servico.produtos_vinculados = prods_standard
-                else:
-                    novo_servico.produtos_vinculados = prods_premium
-                db.session.add(novo_servico)
-            db.session.commit()
-        else:
-            # Caso a tabela já exista, forçamos o vínculo para os serviços que estiverem vazios
-            servicos = Servico.query.all()
-            for s in servicos:
-                if not s.produtos_vinculados:
-                    if 'Standard' in s.nome:
-                        s.produtos_vinculados = prods_standard
-                    elif 'Premium' in s.nome:
-                        s.produtos_vinculados = prods_premium
-            db.session.commit()
-            
-    except Exception as e:
-        print(f"Erro ao inicializar serviços: {e}")
+@app.cli.command('fechar-meses')
+def comando_fechar_meses():
+    """Gera todos os fechamentos mensais pendentes."""
+    fechados = processar_fechamentos_pendentes()
+    print(f"Meses fechados: {', '.join(fechados)}" if fechados else "Nenhum fechamento pendente.")
 
-with app.app_context():
-    db.create_all()
-    verificar_migracoes_banco()
-    inicializar_configuracoes_financeiras()
-    inicializar_produtos_padrao() 
-    inicializar_servicos_padrao()
+@app.cli.command('compactar-estoque')
+def comando_compactar_estoque():
+    """Grava a foto diária do saldo dos produtos movimentados desde a última foto."""
+    print(f"{compactar_estoque()} fotos de saldo gravadas.")
+
+@app.cli.command('processar-midias')
+def comando_processar_midias():
+    """Gera miniaturas e posters das mídias pendentes ou com processamento abandonado."""
+    print(f"{processar_pendentes()} mídias processadas.")
+
+@app.cli.command('reconstruir-clientes')
+def comando_reconstruir_clientes():
+    """Confere lavagens, canceladas, total gasto e última visita de cada cliente com os agendamentos e corrige."""
+    divergencias = reconstruir_agregados_clientes()
+    for cliente_id, nome, armazenado, real in divergencias:
+        print(f"Cliente {cliente_id} ({nome}): gravado {armazenado}, real {real}")
+    print(f"{len(divergencias)} clientes corrigidos." if divergencias else "Agregados dos clientes conferem.")
+
+@app.cli.command('ressincronizar-catalogo')
+def comando_ressincronizar_catalogo():
+    """Reaplica custos/doses do catálogo padrão (sobrescreve edições) e cadastra produtos faltantes."""
+    atualizados, novos = ressincronizar_catalogo()
+    print(f"{atualizados} produtos ressincronizados, {novos} cadastrados.")
 
 try:
     os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 except OSError:
     pass
 
+# Cache das telas de leitura: ligado com CACHE_REDIS_URL (compartilhado entre workers); CACHE_PAGINAS=0 desliga,
+# CACHE_PAGINAS=1 liga em memória (só para servidores com um único processo)
+modo_cache_paginas = os.environ.get('CACHE_PAGINAS')
+cache_paginas.configurar(os.environ.get('CACHE_REDIS_URL'), ativo=None if modo_cache_paginas is None else modo_cache_paginas != '0')
+
+@event.listens_for(db.session, 'after_flush')
+def registrar_tabelas_alteradas(session, flush_context):
+    alteradas = session.info.setdefault('tabelas_alteradas', set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        alteradas.add(obj.__tablename__)
+        if isinstance(obj, Produto) and altera_custo_receita(session, obj):
+            alteradas.add('receitas')
+
+@event.listens_for(db.session, 'do_orm_execute')
+def registrar_dml_em_massa(execucao):
+    # UPDATE/INSERT/DELETE em massa (session.execute) não passam pelo flush
+    if execucao.is_update or execucao.is_insert or execucao.is_delete:
+        alteradas = execucao.session.info.setdefault('tabelas_alteradas', set())
+        alteradas.add(execucao.statement.table.name)
+        # UPDATE em massa de produtos é só movimento de estoque; custos são editados pelo ORM
+        if execucao.statement.table.name == 'produtos' and not execucao.is_update:
+            alteradas.add('receitas')
+
+@event.listens_for(db.session, 'after_commit')
+def invalidar_cache_paginas(session):
+    # Só depois do commit: antes disso outra requisição poderia recolocar os dados antigos no cache
+    alteradas = session.info.pop('tabelas_alteradas', None)
+    if alteradas:
+        cache_paginas.invalidar(alteradas)
+
+@event.listens_for(db.session, 'after_rollback')
+def descartar_tabelas_alteradas(session):
+    session.info.pop('tabelas_alteradas', None)
+
+# Cache curto das buscas do typeahead de clientes (cada tecla vira uma requisição)
+cache_busca_clientes = CacheLRU(tamanho_maximo=256, ttl_segundos=30)
+
+@event.listens_for(db.session, 'after_flush')
+def invalidar_busca_clientes(session, flush_context):
+    # Qualquer escrita em clientes/motos (inclusive saldo de descontos) descarta as buscas em cache
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, (Cliente, Moto)):
+            cache_busca_clientes.limpar()
+            return
+
+@event.listens_for(db.session, 'do_orm_execute')
+def invalidar_busca_clientes_em_massa(execucao):
+    # UPDATE/DELETE em massa não passam pelo flush (ex.: desconto creditado ao padrinho em indicacoes.py)
+    if (execucao.is_update or execucao.is_delete) and execucao.statement.table.name in ('clientes', 'motos'):
+        cache_busca_clientes.limpar()
+
+@app.template_global()
+def url_midia(chave):
+    # Bucket com URL pública é acessado direto; os demais casos passam pela rota /midia
+    return obter_armazenamento().url_publica(chave) or url_for('servir_midia', chave=chave)
+
 @app.template_filter('data_pt')
 def format_data_pt(value):
     if not value: return ""
@@ -329,18 +182,23 @@ def format_data_pt(value):
 
 # --- DASHBOARD ---
 @app.route('/')
+@cache_paginas.pagina('agendamentos', 'clientes', 'motos', 'produtos', 'servicos', 'servico_produto', 'configuracao_financeira')
 def dashboard():
     hoje_data = datetime.now().date()
     hoje_completo = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
     
     agendamentos = Agendamento.query.filter(Agendamento.data_agendada >= hoje_completo).order_by(Agendamento.data_agendada).all()
-    produtos_alerta = Produto.query.filter(Produto.estoque_atual <= Produto.ponto_pedido).all()
-    clientes_todos = Cliente.query.all()
-    config = ConfiguracaoFinanceira.query.first()
+    produtos_alerta = Produto.query.filter((Produto.estoque_atual - Produto.ponto_pedido) <= 0).all()
+    config = cache_catalogo.config()
+
+    # Produtos que ainda estão acima do ponto de pedido, mas vão cruzá-lo nos próximos dias
+    ids_alerta = {p.id for p in produtos_alerta}
+    previstos = [p for p in alertas_reposicao(prever_estoque(hoje_data), hoje_data) if p.produto_id not in ids_alerta]
+    produtos_previstos = {p.id: p for p in Produto.query.filter(Produto.id.in_([p.produto_id for p in previstos]))} if previstos else {}
+    alertas_previsao = [(produtos_previstos[p.produto_id], p) for p in previstos if p.produto_id in produtos_previstos]
     
-    servicos_db = Servico.query.all()
     tabela_precos = {}
-    for s in servicos_db:
+    for s in cache_catalogo.servicos():
         if s.categoria not in tabela_precos:
             tabela_precos[s.categoria] = []
         tabela_precos[s.categoria].append({'nome': s.nome, 'valor': s.valor})
@@ -348,35 +206,28 @@ def dashboard():
     return render_template('dashboard.html', 
                            agendamentos=agendamentos, 
                            alertas=produtos_alerta, 
-                           clientes_todos=clientes_todos, 
+                           alertas_previsao=alertas_previsao,
                            hoje=hoje_data,
                            tabela_precos=tabela_precos,
                            config=config)
 
 # --- FINANCEIRO ---
 @app.route('/financeiro')
+@cache_paginas.pagina('agendamentos', 'clientes', 'motos', 'produtos', 'servicos', 'configuracao_financeira', 'fechamento_mensal')
 def financeiro():
-    config = ConfiguracaoFinanceira.query.first()
+    config = cache_catalogo.config()
     if not config:
         config = ConfiguracaoFinanceira()
         db.session.add(config)
         db.session.commit()
         
-    processar_fechamentos_pendentes()
-    
     mes_query = request.args.get('mes')
     hoje = datetime.now().date()
     
     if mes_query:
         try:
             ano_q, mes_q = map(int, mes_query.split('-'))
-            ano_prox, mes_prox = get_proximo_mes(ano_q, mes_q)
-            
-            q_dia_inicio = get_quarto_dia_util(ano_q, mes_q)
-            q_dia_fim = get_quarto_dia_util(ano_prox, mes_prox)
-            
-            data_inicio = q_dia_inicio + timedelta(days=1)
-            data_fim = q_dia_fim
+            data_inicio, data_fim = limites_ciclo(ano_q, mes_q)
             mes_referencia = mes_query
             
             ano_ant_q, mes_ant_q = get_mes_anterior(ano_q, mes_q)
@@ -386,19 +237,15 @@ def financeiro():
     else:
         data_inicio, data_fim, mes_referencia, mes_anterior_str = obter_ciclo_atual(hoje)
         
-    concluidos = Agendamento.query.filter(
-        Agendamento.data_agendada >= datetime.combine(data_inicio, datetime.min.time()),
-        Agendamento.data_agendada <= datetime.combine(data_fim, datetime.max.time()),
-        Agendamento.status.in_(['Lavagem Concluída', 'Retirado'])
-    ).all()
-    
-    # 1. Receita e Margem
-    faturamento_bruto = sum(a.valor_cobrado for a in concluidos)
-    faturamento_liquido = sum(a.valor_liquido if a.valor_liquido else a.valor_cobrado for a in concluidos)
+    # 1. Receita e Margem (totais do ciclo somados no banco)
+    totais = totais_ciclo(data_inicio, data_fim)
+    total_motos_ciclo = totais['quantidade']
+    faturamento_bruto = totais['faturamento_bruto']
+    faturamento_liquido = totais['faturamento_liquido']
     total_taxas_pagamento = faturamento_bruto - faturamento_liquido
     
-    custo_produtos_total = sum(a.custo_total_produtos for a in concluidos)
-    total_outras_variaveis = sum(a.gastos_extras for a in concluidos)
+    custo_produtos_total = totais['custo_produtos']
+    total_outras_variaveis = totais['gastos_extras']
     total_custos_variaveis = custo_produtos_total + total_outras_variaveis
     
     custos_fixos_base = config.aluguel_iptu + config.pro_labore + config.agua_energia_base + config.internet_telefone + config.mei_impostos + config.marketing + config.seguro
@@ -409,20 +256,20 @@ def financeiro():
     custos_fixos_total = custos_fixos_base + deficit_anterior
     
     margem_contribuicao_total = faturamento_liquido - total_custos_variaveis
-    margem_media = margem_contribuicao_total / len(concluidos) if concluidos else 0
+    margem_media = margem_contribuicao_total / total_motos_ciclo if total_motos_ciclo else 0
     lucro_estimado = margem_contribuicao_total - custos_fixos_total
-    ticket_medio = faturamento_bruto / len(concluidos) if concluidos else 0
-    total_motos_ciclo = len(concluidos)
+    ticket_medio = faturamento_bruto / total_motos_ciclo if total_motos_ciclo else 0
 
     # --- LÓGICA INTELIGENTE DE META DE MOTOS ---
-    menor_servico = Servico.query.order_by(Servico.valor.asc()).first()
+    servicos = sorted(cache_catalogo.servicos(), key=lambda s: (s.categoria, s.valor))
+    menor_servico = min(servicos, key=lambda s: s.valor, default=None)
     pior_margem = 50.0 # Fallback de segurança
     
     if menor_servico and menor_servico.valor > 0:
         # Pior cenário exigido: Pagamento em Crédito Parcelado
         taxa_pior = config.taxa_credito_parcelado
         receita_liquida_pior = menor_servico.valor - (menor_servico.valor * (taxa_pior / 100.0))
-        custo_prod_pior = sum(p.custo_por_dose for p in menor_servico.produtos_vinculados) if menor_servico.produtos_vinculados else 0.0
+        custo_prod_pior = menor_servico.custo_receita
         pior_margem_calc = receita_liquida_pior - custo_prod_pior
         
         if pior_margem_calc > 0:
@@ -437,37 +284,24 @@ def financeiro():
     else:
         meta_motos = total_motos_ciclo # Meta já foi atingida ou ultrapassada
 
+    # Tempo de box que a meta restante exige, pela duração real média das lavagens
+    minutos_por_moto = duracao_media_geral()
+    horas_box_meta = None
+    if minutos_por_moto and motos_restantes_meta > 0:
+        horas_box_meta = motos_restantes_meta * minutos_por_moto / 60 / (config.boxes_lavagem or 1)
+
     
-    # 2. DRE Lista
-    dre_lista = []
-    for a in concluidos:
-        recebido = a.valor_liquido if a.valor_liquido else a.valor_cobrado
-        produtos = a.custo_total_produtos
-        desp_variaveis = a.gastos_extras
-        margem_contribuicao_moto = recebido - produtos - desp_variaveis
-        
-        dre_lista.append({
-            'cliente': a.cliente.nome,
-            'moto': f"{a.moto.modelo} ({a.moto.placa})",
-            'data': a.data_agendada,
-            'valor_cobrado': a.valor_cobrado,
-            'forma_pagamento': a.forma_pagamento_real if a.forma_pagamento_real else (a.forma_pagamento_prevista if a.forma_pagamento_prevista else 'PIX'),
-            'valor_recebido': recebido,
-            'gasto_produtos': produtos,
-            'despesas_variaveis': desp_variaveis,
-            'margem_contribuicao': margem_contribuicao_moto
-        })
-        
-    dre_lista.sort(key=lambda x: x['data'])
+    # 2. DRE Lista (projeção única com cliente e moto já unidos)
+    dre_lista = linhas_dre(data_inicio, data_fim)
     
     # 3. GESTÃO PATRIMONIAL E SUSTENTAÇÃO
     total_aporte = config.aporte_erick + config.aporte_andrei
     total_capex = config.capex_produtos + config.capex_ferramentas + config.capex_estrutura + config.capex_marketing + config.capex_outros
     
-    # Soma todo o histórico
-    todos_fechamentos = FechamentoMensal.query.all()
-    lucro_historico_fechados = sum(f.lucro_real for f in todos_fechamentos)
-    retiradas_historico = sum(f.retiradas_extras for f in todos_fechamentos)
+    # Histórico lido dos saldos acumulados do último fechamento
+    ultimo_fechamento = obter_ultimo_fechamento()
+    lucro_historico_fechados = (ultimo_fechamento.lucro_acumulado or 0.0) if ultimo_fechamento else 0.0
+    retiradas_historico = (ultimo_fechamento.retiradas_acumuladas or 0.0) if ultimo_fechamento else 0.0
     
     # Acumulado = Histórico + Mês Atual (se for ciclo fechado ou aberto)
     lucro_acumulado = lucro_historico_fechados + lucro_estimado
@@ -478,7 +312,6 @@ def financeiro():
     
     is_sustentavel = lucro_estimado >= 0
     
-    servicos = Servico.query.order_by(Servico.categoria, Servico.valor).all()
     produtos_todos = Produto.query.order_by(Produto.nome).all()
     
     meses_disponiveis = []
@@ -508,6 +341,8 @@ def financeiro():
                            config=config,
                            meta_motos=meta_motos,
                            motos_restantes_meta=motos_restantes_meta,
+                           horas_box_meta=horas_box_meta,
+                           minutos_por_moto=minutos_por_moto,
                            dre_lista=dre_lista,
                            mes_referencia=mes_referencia,
                            data_inicio=data_inicio,
@@ -626,6 +461,13 @@ def salvar_configuracao_financeira():
         config.minimo_parcelamento = float(request.form.get('minimo_parcelamento', config.minimo_parcelamento))
         config.capacidade_mensal = int(request.form.get('capacidade_mensal', config.capacidade_mensal))
         
+        # Agenda
+        config.boxes_lavagem = max(int(request.form.get('boxes_lavagem', config.boxes_lavagem or 1)), 1)
+        config.horario_abertura = request.form.get('horario_abertura', config.horario_abertura) or '08:00'
+        config.horario_fechamento = request.form.get('horario_fechamento', config.horario_fechamento) or '18:00'
+        config.intervalo_slots_minutos = max(int(request.form.get('intervalo_slots_minutos', config.intervalo_slots_minutos or 30)), 5)
+        config.duracao_padrao_minutos = max(int(request.form.get('duracao_padrao_minutos', config.duracao_padrao_minutos or 60)), 5)
+        
         # Patrimonial (Aportes e CAPEX)
         config.aporte_erick = float(request.form.get('aporte_erick', config.aporte_erick))
         config.aporte_andrei = float(request.form.get('aporte_andrei', config.aporte_andrei))
@@ -659,7 +501,9 @@ def restart_financeiro():
             custos_totais=0.0,
             lucro_real=0.0,
             deficit_acumulado=0.0,
-            retiradas_extras=0.0
+            retiradas_extras=0.0,
+            lucro_acumulado=0.0,
+            retiradas_acumuladas=0.0
         )
         db.session.add(marco_zero)
         db.session.commit()
@@ -686,6 +530,7 @@ def novo_agendamento():
         parcelas = int(request.form.get('parcelas', 1))
         
         data_agendada = datetime.strptime(f"{data_str} {hora_str}", '%Y-%m-%d %H:%M')
+        verificar_disponibilidade(data_agendada, tipo_servico)
         
         cliente = Cliente.query.get(cliente_id)
         aplicar_desconto = False
@@ -710,6 +555,9 @@ def novo_agendamento():
         
         msg_desconto = " (Com 10% de desconto!)" if aplicar_desconto else ""
         flash(f'Agendamento realizado!{msg_desconto}', 'success')
+    except HorarioIndisponivel as e:
+        db.session.rollback()
+        flash(str(e), 'error')
     except Exception as e:
         db.session.rollback()
         flash(f'Erro: {str(e)}', 'error')
@@ -723,9 +571,21 @@ def editar_agendamento():
         hora = request.form.get('data_hora')
         agenda = Agendamento.query.get(id_)
         if agenda:
-            agenda.data_agendada = datetime.strptime(f"{data} {hora}", '%Y-%m-%d %H:%M')
+            nova_data = datetime.strptime(f"{data} {hora}", '%Y-%m-%d %H:%M')
+            # Correções de lavagens concluídas ou passadas não disputam box com a agenda futura
+            agora = datetime.now()
+            if (agenda.status != 'Cancelado' and agenda.status not in STATUS_CONCLUIDOS and nova_data != agenda.data_agendada
+                    and agenda.data_agendada >= agora and nova_data >= agora):
+                verificar_disponibilidade(nova_data, agenda.tipo_servico, ignorar_id=agenda.id)
+            data_anterior = agenda.data_agendada
+            agenda.data_agendada = nova_data
+            if agenda.status in STATUS_CONCLUIDOS and nova_data != data_anterior:
+                recalcular_ultima_visita(agenda.cliente_id)
             db.session.commit()
             flash('Atualizado!', 'success')
+    except HorarioIndisponivel as e:
+        db.session.rollback()
+        flash(str(e), 'error')
     except: flash('Erro ao editar', 'error')
     return redirect(url_for('dashboard'))
 
@@ -736,7 +596,9 @@ def cancelar_agendamento(id):
         if a.status != 'Cancelado' and a.desconto_aplicado:
             a.cliente.qtd_descontos += 1
             
+        status_anterior = a.status
         a.status = 'Cancelado'
+        registrar_mudanca_status(a, status_anterior)
         db.session.commit()
         flash('Cancelado. (Se havia desconto, foi devolvido)', 'info')
     return redirect(url_for('dashboard'))
@@ -749,6 +611,7 @@ def excluir_agendamento(id):
             if a.status != 'Cancelado' and a.status != 'Lavagem Concluída' and a.status != 'Retirado' and a.desconto_aplicado:
                 a.cliente.qtd_descontos += 1
 
+            registrar_mudanca_status(a, a.status, removido=True)
             for midia in a.midias:
                 db.session.delete(midia)
             db.session.delete(a)
@@ -807,18 +670,84 @@ def buscar_cliente():
     termo = request.args.get('q', '').strip()
     if len(termo) < 1:
         return jsonify([]) 
+    
+    chave = termo.lower()
+    resultado = cache_busca_clientes.obter(chave)
+    if resultado is None:
+        clientes = buscar_clientes(termo, limite=10)
         
-    clientes = Cliente.query.filter(
-        (Cliente.nome.ilike(f'%{termo}%')) | (Cliente.telefone.ilike(f'%{termo}%'))
-    ).limit(10).all()
+        resultado = [{
+            'id': c.id, 
+            'text': f"{c.nome} - {c.telefone}", 
+            'motos': [m.to_dict() for m in c.motos], 
+            'qtd_descontos': c.qtd_descontos,
+            'preferencias': c.preferencias
+        } for c in clientes]
+        cache_busca_clientes.guardar(chave, resultado)
     
+    return jsonify(resultado)
+
+@app.route('/api/clientes/<int:cliente_id>/midias')
+def api_midias_cliente(cliente_id):
+    # Galeria carregada sob demanda pelo modal de clientes.html; só miniaturas na grade, a versão web ao clicar
+    pagina = request.args.get('pagina', 1, type=int)
+    por_pagina = min(request.args.get('por_pagina', 24, type=int), 100)
+
+    paginacao = MidiaAgendamento.query.join(Agendamento).filter(
+        Agendamento.cliente_id == cliente_id,
+        Agendamento.status.in_(STATUS_CONCLUIDOS)
+    ).order_by(MidiaAgendamento.data_upload.desc(), MidiaAgendamento.id.desc()).paginate(
+        page=pagina, per_page=por_pagina, error_out=False
+    )
+
+    return jsonify({
+        'itens': [{
+            'id': m.id,
+            'tipo': m.tipo,
+            'miniatura': url_midia(m.caminho_miniatura) if m.caminho_miniatura else (url_midia(m.caminho_arquivo) if m.tipo == 'foto' else None),
+            'ampliada': url_midia(m.caminho_web or m.caminho_arquivo),
+            'original': url_midia(m.caminho_arquivo),
+            'processando': m.status_processamento in ('pendente', 'processando'),
+            'data': m.data_upload.strftime('%d/%m/%Y') if m.data_upload else ''
+        } for m in paginacao.items],
+        'total': paginacao.total,
+        'proxima_pagina': paginacao.next_num if paginacao.has_next else None
+    })
+
+@app.route('/api/clientes/<int:cliente_id>/agendamentos')
+def api_agendamentos_cliente(cliente_id):
+    # Opções do modal de upload, carregadas quando ele abre (a listagem de clientes não traz o histórico)
+    linhas = db.session.query(
+        Agendamento.id, Agendamento.data_agendada, Agendamento.status, Moto.modelo
+    ).outerjoin(Moto, Moto.id == Agendamento.moto_id).filter(
+        Agendamento.cliente_id == cliente_id
+    ).order_by(Agendamento.data_agendada.desc()).all()
+
     return jsonify([{
-        'id': c.id, 
-        'text': f"{c.nome} - {c.telefone}", 
-        'motos': [m.to_dict() for m in c.motos], 
-        'qtd_descontos': c.qtd_descontos,
-        'preferencias': c.preferencias
-    } for c in clientes])
+        'id': id_,
+        'rotulo': f"{data_agendada.strftime('%d/%m')} - {modelo or ''} ({status})"
+    } for id_, data_agendada, status, modelo in linhas])
+
+@app.route('/api/clientes/<int:cliente_id>/indicacoes')
+def api_indicacoes_cliente(cliente_id):
+    # Subárvore completa em uma consulta (tabela de fechamento indicacao_arvore)
+    return jsonify([{
+        'id': c.id,
+        'nome': c.nome,
+        'profundidade': profundidade,
+        'padrinho_id': c.indicado_por_id,
+        'qtd_lavagens': c.qtd_lavagens or 0,
+        'total_gasto': c.total_gasto or 0.0
+    } for c, profundidade in subarvore_indicacoes(cliente_id)])
+
+@app.route('/api/slots')
+def api_slots():
+    # Horários livres do dia para o serviço escolhido no modal de agendamento (dashboard.html)
+    try:
+        dia = datetime.strptime(request.args.get('dia', ''), '%Y-%m-%d').date()
+    except ValueError:
+        return jsonify({'erro': 'Parâmetro dia inválido (use AAAA-MM-DD).'}), 400
+    return jsonify({'dia': dia.isoformat(), 'slots': slots_do_dia(dia, request.args.get('servico'))})
 
 @app.route('/api/adicionar_moto', methods=['POST'])
 def adicionar_moto():
@@ -903,6 +832,7 @@ def atualizar_status(id, status):
     status = unquote(status)
     
     a = Agendamento.query.get(id)
+    status_anterior = a.status
     horario_str = request.form.get('horario')
     
     if horario_str:
@@ -919,27 +849,27 @@ def atualizar_status(id, status):
         a.tempo_inicio = horario_dt
         
     elif status == 'Lavagem Concluída':
+        ja_concluida = a.status in STATUS_CONCLUIDOS
         a.status = 'Lavagem Concluída'
         a.tempo_fim = horario_dt
+        if not ja_concluida:
+            registrar_duracao(a)
         
         if a.custo_total_produtos == 0:
             custo = 0
-            servico_realizado = Servico.query.filter_by(nome=a.tipo_servico).first()
+            # Receita e custo lidos do banco (o cache do catálogo é só para as telas)
+            servico_realizado = consultar_servico(a.tipo_servico)
             
             # Dá baixa apenas nos produtos que fazem parte da receita deste serviço específico
-            if servico_realizado and servico_realizado.produtos_vinculados:
-                for p in servico_realizado.produtos_vinculados:
-                    # Removemos a condicional que barrava a baixa e o custo se não houvesse estoque
-                    p.estoque_atual -= p.gasto_medio_lavagem
-                    custo += p.custo_por_dose
+            if servico_realizado and servico_realizado.produtos_ids:
+                # Baixa e custo mesmo sem estoque suficiente (o saldo pode ficar negativo)
+                baixar_receita(servico_realizado.produtos_ids, a.id)
+                custo = servico_realizado.custo_receita
             a.custo_total_produtos = custo
         
-        if a.cliente.indicado_por_id:
-            lavagens_concluidas = Agendamento.query.filter(Agendamento.cliente_id == a.cliente.id, Agendamento.status.in_(['Lavagem Concluída', 'Retirado'])).count()
-            if lavagens_concluidas == 1:
-                padrinho = Cliente.query.get(a.cliente.indicado_por_id)
-                if padrinho:
-                    padrinho.qtd_descontos += 1
+        # Desconto do padrinho na primeira lavagem concluída do indicado (flag gravada no cliente)
+        if not a.cliente.primeira_lavagem_concluida:
+            registrar_primeira_lavagem(a.cliente)
                     
     elif status == 'Retirado':
         a.status = 'Retirado'
@@ -967,6 +897,7 @@ def atualizar_status(id, status):
             a.forma_pagamento_real = a.forma_pagamento_prevista
             a.valor_liquido = a.valor_cobrado
 
+    registrar_mudanca_status(a, status_anterior)
     db.session.commit()
     flash(f'Status atualizado para {status} às {horario_dt.strftime("%H:%M")}', 'info')
     return redirect(url_for('dashboard'))
@@ -976,29 +907,56 @@ def upload_midia(agendamento_id):
     if 'arquivo' not in request.files: return 'Erro', 400
     arquivo = request.files['arquivo']
     if arquivo:
-        filename = secure_filename(f"{agendamento_id}_{datetime.now().timestamp()}_{arquivo.filename}")
-        arquivo.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
-        db.session.add(MidiaAgendamento(agendamento_id=agendamento_id, caminho_arquivo=filename, tipo=request.form.get('tipo')))
-        db.session.commit()
+        try:
+            midia = salvar_upload_midia(arquivo, agendamento_id, obter_armazenamento(), app.config['MAX_CONTENT_LENGTH'])
+            db.session.add(midia)
+            db.session.commit()
+            fila_midias.enfileirar(midia.id)
+        except UploadInvalido as e:
+            flash(str(e), 'error')
     return redirect(request.referrer or url_for('dashboard'))
 
+@app.route('/midia/<path:chave>')
+def servir_midia(chave):
+    armazenamento = obter_armazenamento()
+    if app.config['ARMAZENAMENTO'] == 's3':
+        resposta = redirect(armazenamento.url_temporaria(chave))
+        resposta.headers['Cache-Control'] = CACHE_CONTROL_LINK_TEMPORARIO
+        return resposta
+    resposta = send_from_directory(app.config['UPLOAD_FOLDER'], chave)
+    # Chaves derivadas do conteúdo nunca mudam de significado
+    resposta.headers['Cache-Control'] = CACHE_CONTROL_IMUTAVEL
+    return resposta
+
 # --- GESTÃO DE PRODUTOS ---
 @app.route('/produtos', methods=['GET', 'POST'])
+@cache_paginas.pagina('produtos', 'agendamentos', 'servicos', 'servico_produto')
 def gerenciar_produtos():
     if request.method == 'POST':
-        db.session.add(Produto(
+        produto = Produto(
             nome=request.form.get('nome'), 
             unidade_medida=request.form.get('unidade'),
             custo_compra=float(request.form.get('custo')), 
             quantidade_compra=float(request.form.get('qtd_compra')),
             gasto_medio_lavagem=float(request.form.get('gasto_medio')), 
-            estoque_atual=float(request.form.get('estoque_inicial')),
+            estoque_atual=0.0,
             link_compra=request.form.get('link_compra') 
-        ))
+        )
+        db.session.add(produto)
+        definir_saldo(produto, float(request.form.get('estoque_inicial')), tipo='cadastro')
         db.session.commit()
         flash('Produto cadastrado com sucesso!', 'success')
         
-    return render_template('produtos.html', produtos=Produto.query.all())
+    # Saldo histórico (?estoque_em=AAAA-MM-DD): última foto diária + movimentos até o fim do dia local
+    estoque_em, saldos_na_data = None, None
+    try:
+        estoque_em = date.fromisoformat(request.args.get('estoque_em', ''))
+        saldos_na_data = saldos_no_fim_do_dia(estoque_em)
+    except ValueError:
+        estoque_em = None
+
+    return render_template('produtos.html', produtos=Produto.query.all(), previsoes=prever_estoque(), hoje=date.today(),
+                           estoque_em=estoque_em, saldos_na_data=saldos_na_data)
 
 @app.route('/editar_produto', methods=['POST'])
 def editar_produto():
@@ -1008,7 +966,11 @@ def editar_produto():
         if prod:
             prod.nome = request.form.get('nome')
             prod.unidade_medida = request.form.get('unidade_medida')
-            prod.estoque_atual = float(request.form.get('estoque_atual'))
+            # Só lança ajuste se o saldo foi alterado no formulário: baixas feitas enquanto
+            # o modal estava aberto não são desfeitas
+            estoque_informado = float(request.form.get('estoque_atual'))
+            if estoque_informado != float(request.form.get('estoque_exibido', estoque_informado)):
+                definir_saldo(prod, estoque_informado)
             prod.custo_compra = float(request.form.get('custo_compra'))
             prod.quantidade_compra = float(request.form.get('quantidade_compra'))
             prod.gasto_medio_lavagem = float(request.form.get('gasto_medio_lavagem'))
@@ -1020,13 +982,27 @@ def editar_produto():
         flash(f'Erro ao editar produto: {e}', 'error')
     return redirect(url_for('gerenciar_produtos'))
 
+@app.route('/registrar_compra', methods=['POST'])
+def registrar_compra_produto():
+    try:
+        quantidade = float(request.form.get('quantidade'))
+        if quantidade <= 0:
+            flash('Informe uma quantidade maior que zero.', 'error')
+        elif registrar_compra(request.form.get('produto_id', type=int), quantidade):
+            db.session.commit()
+            flash('Compra registrada no estoque!', 'success')
+    except Exception as e:
+        db.session.rollback()
+        flash(f'Erro ao registrar compra: {e}', 'error')
+    return redirect(url_for('gerenciar_produtos'))
+
 @app.route('/excluir_produto/<int:id>')
 def excluir_produto(id):
     try:
         prod = Produto.query.get(id)
         if prod:
             if prod.estoque_atual > 0:
-                prod.estoque_atual = 0.0
+                definir_saldo(prod, 0.0)
                 db.session.commit()
                 flash('Produto movido para "Fora de Estoque" (Quantidade zerada).', 'info')
             else:
@@ -1038,27 +1014,96 @@ def excluir_produto(id):
     return redirect(url_for('gerenciar_produtos'))
 
 @app.route('/clientes')
+@cache_paginas.pagina('clientes', 'motos', 'agendamentos', 'midia_agendamento')
 def listar_clientes():
-    clientes_brutos = Cliente.query.all()
+    pagina = request.args.get('pagina', 1, type=int)
+    por_pagina = min(request.args.get('por_pagina', 50, type=int), 200)
+
+    concluido = Agendamento.status.in_(STATUS_CONCLUIDOS)
+
+    # Só a contagem de mídias; a galeria em si vem de /api/clientes/<id>/midias quando o modal abre
+    contagem_midias = db.session.query(
+        Agendamento.cliente_id.label('cliente_id'),
+        func.count(MidiaAgendamento.id).label('qtd_midias')
+    ).join(MidiaAgendamento, MidiaAgendamento.agendamento_id == Agendamento.id).filter(
+        concluido
+    ).group_by(Agendamento.cliente_id).subquery()
+
+    # Relacionamentos carregados em lote: o número de consultas não cresce com a quantidade de clientes
+    # Agregados já gravados no cliente (agregados_clientes.py); a ordenação usa ix_clientes_ranking
+    paginacao = db.session.query(
+        Cliente,
+        func.coalesce(contagem_midias.c.qtd_midias, 0),
+        Cliente.agendamentos.any()
+    ).outerjoin(
+        contagem_midias, contagem_midias.c.cliente_id == Cliente.id
+    ).options(
+        joinedload(Cliente.padrinho),
+        selectinload(Cliente.motos)
+    ).order_by(Cliente.total_gasto.desc(), Cliente.nome).paginate(page=pagina, per_page=por_pagina, error_out=False)
+
+    indicacoes = resumo_indicacoes([c.id for c, _, _ in paginacao.items])
+
     clientes_processados = []
-    
-    for c in clientes_brutos:
-        agendamentos_recentes = sorted(c.agendamentos, key=lambda x: x.data_agendada, reverse=True)
-        lavagens_concluidas = [a for a in c.agendamentos if a.status in ('Lavagem Concluída', 'Retirado')]
-        lavagens_canceladas = [a for a in c.agendamentos if a.status == 'Cancelado']
-        
+    for c, qtd_midias, tem_agendamentos in paginacao.items:
         clientes_processados.append({
-            'dados': c, 
+            'dados': c,
             'motos': c.motos,
-            'agendamentos': agendamentos_recentes, 
-            'qtd_lavagens': len(lavagens_concluidas),
-            'qtd_canceladas': len(lavagens_canceladas),
-            'total_gasto': sum(a.valor_cobrado for a in lavagens_concluidas),
-            'midias': [m for a in lavagens_concluidas for m in a.midias]
+            'tem_agendamentos': tem_agendamentos,
+            'qtd_lavagens': c.qtd_lavagens or 0,
+            'qtd_canceladas': c.qtd_canceladas or 0,
+            'total_gasto': c.total_gasto or 0.0,
+            'qtd_midias': qtd_midias,
+            'indicacoes': indicacoes.get(c.id)
         })
-    
-    clientes_processados.sort(key=lambda x: x['total_gasto'], reverse=True)
-    return render_template('clientes.html', clientes=clientes_processados, clientes_todos=clientes_brutos)
+
+    return render_template('clientes.html', clientes=clientes_processados, paginacao=paginacao)
+
+# --- IMPORTAÇÃO E EXPORTAÇÃO (CSV / XLSX) ---
+MAX_ERROS_EXIBIDOS = 20
+
+@app.route('/importar/<tipo>', methods=['POST'])
+def importar_planilha(tipo):
+    importador = IMPORTADORES.get(tipo)
+    arquivo = request.files.get('arquivo')
+    if not importador or not arquivo or not arquivo.filename:
+        flash('Selecione o tipo de dado e um arquivo .csv ou .xlsx.', 'error')
+        return redirect(url_for('listar_clientes'))
+    try:
+        resultado = importador(ler_planilha(arquivo.stream, arquivo.filename))
+        cache_busca_clientes.limpar()
+        flash(f'Importação de {tipo}: {resultado.importados} linha(s) gravada(s), {len(resultado.erros)} com problema.',
+              'success' if not resultado.erros else 'info')
+        for numero, mensagem in resultado.erros[:MAX_ERROS_EXIBIDOS]:
+            flash(f'Linha {numero}: {mensagem}', 'error')
+        if len(resultado.erros) > MAX_ERROS_EXIBIDOS:
+            flash(f'... e mais {len(resultado.erros) - MAX_ERROS_EXIBIDOS} linha(s) com problema.', 'error')
+    except PlanilhaInvalida as e:
+        flash(str(e), 'error')
+    except Exception as e:
+        # Lotes anteriores já foram gravados; só o lote atual é desfeito
+        db.session.rollback()
+        flash(f'Erro na importação: {e}', 'error')
+    return redirect(url_for('listar_clientes'))
+
+def _resposta_csv(nome_arquivo, cabecalho, linhas):
+    return Response(stream_with_context(gerar_csv(cabecalho, linhas)), mimetype='text/csv',
+                    headers={'Content-Disposition': f'attachment; filename={nome_arquivo}'})
+
+@app.route('/exportar/<tipo>.csv')
+def exportar_planilha(tipo):
+    if tipo == 'dre':
+        mes = request.args.get('mes')
+        try:
+            ano_q, mes_q = map(int, mes.split('-'))
+            data_inicio, data_fim = limites_ciclo(ano_q, mes_q)
+        except (AttributeError, ValueError):
+            data_inicio, data_fim, mes, _ = obter_ciclo_atual(datetime.now().date())
+        return _resposta_csv(f'dre_{mes}.csv', COLUNAS_DRE, linhas_dre_csv(data_inicio, data_fim))
+    if tipo not in EXPORTACOES:
+        return jsonify({'erro': 'Exportação desconhecida.'}), 404
+    cabecalho, linhas = EXPORTACOES[tipo]
+    return _resposta_csv(f'{tipo}_{date.today().isoformat()}.csv', cabecalho, linhas())
 
 if __name__ == '__main__': 
     app.run(debug=True, host='0.0.0.0')
@@ -0,0 +1,108 @@
+import os
+import shutil
+import mimetypes
+from cache_local import CacheLRU
+
+try:
+    import boto3
+except ImportError: # Só é necessário com ARMAZENAMENTO=s3
+    boto3 = None
+
+# ---------------------------
+# ARMAZENAMENTO DE MÍDIA (local ou compatível com S3)
+# ---------------------------
+# As chaves são o hash do conteúdo (ver midias.py), então um blob nunca muda depois de gravado:
+# uploads repetidos reaproveitam o mesmo arquivo e o navegador pode guardá-lo em cache por um ano.
+
+CACHE_CONTROL_IMUTAVEL = 'public, max-age=31536000, immutable'
+
+# Bucket privado: cada link assinado é reaproveitado na primeira metade da validade, então a
+# galeria repete a mesma URL (e o cache do navegador) e o redirecionamento pode ser guardado
+# pela outra metade sem nunca apontar para um link vencido.
+VALIDADE_LINK_SEGUNDOS = 3600
+CACHE_CONTROL_LINK_TEMPORARIO = f'private, max-age={VALIDADE_LINK_SEGUNDOS // 2}'
+
+class ArmazenamentoLocal:
+    def __init__(self, pasta):
+        self.pasta = pasta
+        try:
+            os.makedirs(pasta, exist_ok=True)
+        except OSError:
+            pass
+
+    def existe(self, chave):
+        return os.path.exists(os.path.join(self.pasta, chave))
+
+    def salvar(self, chave, caminho_origem):
+        # Grava em arquivo temporário e renomeia: leitores nunca veem um blob pela metade
+        destino = os.path.join(self.pasta, chave)
+        temporario = f"{destino}.parcial"
+        shutil.copyfile(caminho_origem, temporario)
+        os.replace(temporario, destino)
+
+    def baixar(self, chave, destino):
+        shutil.copyfile(os.path.join(self.pasta, chave), destino)
+
+    def url_publica(self, chave):
+        # Servido pela rota /midia/<chave> do app
+        return None
+
+class ArmazenamentoS3:
+    """Bucket S3 ou compatível (MinIO, R2, Spaces...). Credenciais pelas variáveis padrão da AWS."""
+
+    def __init__(self, bucket, prefixo='', endpoint_url=None, url_publica=None):
+        if boto3 is None:
+            raise RuntimeError('ARMAZENAMENTO=s3 requer o pacote boto3.')
+        self.bucket = bucket
+        self.prefixo = prefixo.strip('/') + '/' if prefixo.strip('/') else ''
+        self.base_url_publica = url_publica.rstrip('/') if url_publica else None
+        self.cliente = boto3.client('s3', endpoint_url=endpoint_url or None)
+        self._links = CacheLRU(tamanho_maximo=2048, ttl_segundos=VALIDADE_LINK_SEGUNDOS // 2)
+
+    def _nome(self, chave):
+        return self.prefixo + chave
+
+    def existe(self, chave):
+        try:
+            self.cliente.head_object(Bucket=self.bucket, Key=self._nome(chave))
+            return True
+        except self.cliente.exceptions.ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+
+    def salvar(self, chave, caminho_origem):
+        extras = {
+            'CacheControl': CACHE_CONTROL_IMUTAVEL,
+            'ContentType': mimetypes.guess_type(chave)[0] or 'application/octet-stream'
+        }
+        self.cliente.upload_file(caminho_origem, self.bucket, self._nome(chave), ExtraArgs=extras)
+
+    def baixar(self, chave, destino):
+        self.cliente.download_file(self.bucket, self._nome(chave), destino)
+
+    def url_publica(self, chave):
+        return f"{self.base_url_publica}/{self._nome(chave)}" if self.base_url_publica else None
+
+    def url_temporaria(self, chave):
+        # Bucket privado: link assinado, usado pela rota /midia
+        url = self._links.obter(chave)
+        if url is None:
+            url = self.cliente.generate_presigned_url(
+                'get_object', Params={'Bucket': self.bucket, 'Key': self._nome(chave)}, ExpiresIn=VALIDADE_LINK_SEGUNDOS
+            )
+            self._links.guardar(chave, url)
+        return url
+
+_armazenamento = None
+
+def configurar_armazenamento(tipo, pasta_local, bucket=None, prefixo='', endpoint_url=None, url_publica=None):
+    global _armazenamento
+    if tipo == 's3':
+        _armazenamento = ArmazenamentoS3(bucket, prefixo, endpoint_url, url_publica)
+    else:
+        _armazenamento = ArmazenamentoLocal(pasta_local)
+    return _armazenamento
+
+def obter_armazenamento():
+    return _armazenamento
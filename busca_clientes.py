@@ -0,0 +1,101 @@
+from sqlalchemy import text, or_
+from sqlalchemy.orm import selectinload
+from database import db, Cliente, normalizar_texto, apenas_digitos
+
+# ---------------------------
+# BUSCA DE CLIENTES (typeahead)
+# ---------------------------
+# Postgres: índices GIN pg_trgm servem LIKE '%termo%' nas colunas normalizadas.
+# SQLite: tabela FTS5 com tokenizador trigram (conteúdo externo sincronizado por triggers).
+# Termos curtos (< 3 caracteres) usam busca por prefixo no índice B-tree comum.
+
+TAMANHO_MINIMO_TRIGRAMA = 3
+
+SQL_FTS_SQLITE = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS clientes_fts USING fts5("
+    "nome_busca, telefone_digitos, content='clientes', content_rowid='id', tokenize='trigram')",
+    "CREATE TRIGGER IF NOT EXISTS clientes_fts_ai AFTER INSERT ON clientes BEGIN "
+    "INSERT INTO clientes_fts(rowid, nome_busca, telefone_digitos) VALUES (new.id, new.nome_busca, new.telefone_digitos); END",
+    "CREATE TRIGGER IF NOT EXISTS clientes_fts_ad AFTER DELETE ON clientes BEGIN "
+    "INSERT INTO clientes_fts(clientes_fts, rowid, nome_busca, telefone_digitos) VALUES ('delete', old.id, old.nome_busca, old.telefone_digitos); END",
+    "CREATE TRIGGER IF NOT EXISTS clientes_fts_au AFTER UPDATE OF nome_busca, telefone_digitos ON clientes BEGIN "
+    "INSERT INTO clientes_fts(clientes_fts, rowid, nome_busca, telefone_digitos) VALUES ('delete', old.id, old.nome_busca, old.telefone_digitos); "
+    "INSERT INTO clientes_fts(rowid, nome_busca, telefone_digitos) VALUES (new.id, new.nome_busca, new.telefone_digitos); END",
+    "INSERT INTO clientes_fts(clientes_fts) VALUES ('rebuild')"
+]
+
+SQL_TRGM_POSTGRES = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_clientes_nome_busca_trgm ON clientes USING gin (nome_busca gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_clientes_telefone_digitos_trgm ON clientes USING gin (telefone_digitos gin_trgm_ops)"
+]
+
+_fts_sqlite_disponivel = None
+
+def criar_indices_busca(conn):
+    """Cria a estrutura de busca por substring específica do banco. Retorna False se não suportada."""
+    comandos = {'postgresql': SQL_TRGM_POSTGRES, 'sqlite': SQL_FTS_SQLITE}.get(conn.dialect.name)
+    if not comandos:
+        return False
+    try:
+        # No Postgres uma falha (ex: sem permissão para a extensão) não pode abortar a transação da migração
+        if conn.dialect.name == 'postgresql':
+            with conn.begin_nested():
+                for sql in comandos:
+                    conn.execute(text(sql))
+        else:
+            for sql in comandos:
+                conn.execute(text(sql))
+        return True
+    except Exception as e:
+        # Sem pg_trgm/FTS5 a busca continua funcionando pelo caminho de fallback
+        print(f"Índice de busca de clientes indisponível: {e}")
+        return False
+
+def _usar_fts_sqlite():
+    global _fts_sqlite_disponivel
+    if _fts_sqlite_disponivel is None:
+        _fts_sqlite_disponivel = db.session.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'clientes_fts'")
+        ).first() is not None
+    return _fts_sqlite_disponivel
+
+def _filtro_prefixo(coluna, prefixo):
+    # Faixa [prefixo, prefixo + maior caractere) aproveita o índice B-tree em qualquer banco
+    return (coluna >= prefixo) & (coluna < prefixo + '\uffff')
+
+def _padrao_contem(termo):
+    escapado = termo.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f'%{escapado}%'
+
+def _frase_fts(termo):
+    return '"' + termo.replace('"', '""') + '"'
+
+def buscar_clientes(termo, limite=10):
+    termo_norm = normalizar_texto(termo)
+    digitos = apenas_digitos(termo)
+    if not termo_norm:
+        return []
+
+    consulta = Cliente.query.options(selectinload(Cliente.motos))
+    dialeto = db.engine.dialect.name
+
+    if len(termo_norm) < TAMANHO_MINIMO_TRIGRAMA:
+        filtros = [_filtro_prefixo(Cliente.nome_busca, termo_norm)]
+        if digitos:
+            filtros.append(_filtro_prefixo(Cliente.telefone_digitos, digitos))
+        consulta = consulta.filter(or_(*filtros))
+    elif dialeto == 'sqlite' and _usar_fts_sqlite():
+        frases = [_frase_fts(termo_norm)]
+        if len(digitos) >= TAMANHO_MINIMO_TRIGRAMA and digitos != termo_norm:
+            frases.append(_frase_fts(digitos))
+        ids = text("SELECT rowid FROM clientes_fts WHERE clientes_fts MATCH :q").bindparams(q=' OR '.join(frases))
+        consulta = consulta.filter(Cliente.id.in_(ids))
+    else:
+        # Postgres (GIN pg_trgm) ou fallback genérico
+        filtros = [Cliente.nome_busca.like(_padrao_contem(termo_norm), escape='\\')]
+        if len(digitos) >= TAMANHO_MINIMO_TRIGRAMA:
+            filtros.append(Cliente.telefone_digitos.like(_padrao_contem(digitos), escape='\\'))
+        consulta = consulta.filter(or_(*filtros))
+
+    return consulta.order_by(Cliente.nome_busca).limit(limite).all()
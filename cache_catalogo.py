@@ -0,0 +1,138 @@
+import threading
+import time
+from sqlalchemy import func, case, inspect
+from database import db, ConfiguracaoFinanceira, Servico, Produto, servico_produto_assoc
+from cache_paginas import cache_paginas
+
+# ---------------------------
+# CACHE DO CATÁLOGO (configuração financeira + serviços)
+# ---------------------------
+# Tabelas quase estáticas lidas em toda tela e mudança de status. O retrato é refeito quando
+# a versão de alguma das tags abaixo muda (commit que as altera, ver app.py) ou o TTL
+# vence (cobre escritas de outros processos quando o cache não está no Redis). Por isso o cache
+# serve só leituras: valores gravados no banco saem de consultar_servicos() e do próprio banco.
+# 'receitas' só muda quando o custo por dose de um produto muda: baixas de estoque não
+# derrubam o catálogo.
+
+TABELAS_CATALOGO = ('configuracao_financeira', 'servicos', 'servico_produto', 'receitas')
+CAMPOS_CUSTO_DOSE = ('custo_compra', 'quantidade_compra', 'gasto_medio_lavagem')
+
+def altera_custo_receita(session, produto):
+    """Chamado no after_flush: o produto entrou, saiu ou teve alterado algum campo do custo por dose?"""
+    if produto in session.new or produto in session.deleted:
+        return True
+    atributos = inspect(produto).attrs
+    return any(atributos[campo].history.has_changes() for campo in CAMPOS_CUSTO_DOSE)
+
+class ServicoCatalogo:
+    """Cópia somente leitura de um Servico com o custo da receita já calculado."""
+    __slots__ = ('id', 'categoria', 'nome', 'valor', 'descricao', 'produtos_ids', 'custo_receita')
+
+    def __init__(self, id, categoria, nome, valor, descricao, produtos_ids, custo_receita):
+        self.id = id
+        self.categoria = categoria
+        self.nome = nome
+        self.valor = valor
+        self.descricao = descricao
+        self.produtos_ids = produtos_ids
+        self.custo_receita = custo_receita
+
+def consultar_servicos(nome=None):
+    """Serviços com receita e custo lidos agora do banco. Quem grava valores (custo, baixa de estoque)
+    usa esta consulta em vez do cache, que em outro processo pode estar até ttl_segundos atrasado.
+    Com nome, todas as consultas ficam restritas aos serviços com esse nome."""
+    # Custo da receita = soma do custo por dose (Produto.custo_por_dose) dos produtos vinculados
+    custo_dose = case(
+        (Produto.quantidade_compra > 0, Produto.custo_compra / Produto.quantidade_compra * Produto.gasto_medio_lavagem),
+        else_=0.0
+    )
+    consulta_servicos = db.session.query(
+        Servico.id, Servico.categoria, Servico.nome, Servico.valor, Servico.descricao
+    ).order_by(Servico.id)
+    consulta_custos = db.session.query(
+        servico_produto_assoc.c.servico_id, func.sum(custo_dose)
+    ).join(Produto, Produto.id == servico_produto_assoc.c.produto_id).group_by(servico_produto_assoc.c.servico_id)
+    consulta_receitas = db.session.query(servico_produto_assoc.c.servico_id, servico_produto_assoc.c.produto_id)
+    if nome is not None:
+        ids_com_nome = db.session.query(Servico.id).filter(Servico.nome == nome)
+        consulta_servicos = consulta_servicos.filter(Servico.nome == nome)
+        consulta_custos = consulta_custos.filter(servico_produto_assoc.c.servico_id.in_(ids_com_nome))
+        consulta_receitas = consulta_receitas.filter(servico_produto_assoc.c.servico_id.in_(ids_com_nome))
+
+    servicos = consulta_servicos.all()
+    if not servicos:
+        return []
+    receitas = {}
+    custos = dict(consulta_custos.all())
+    for servico_id, produto_id in consulta_receitas:
+        receitas.setdefault(servico_id, []).append(produto_id)
+
+    return [
+        ServicoCatalogo(id_, categoria, nome_, valor, descricao, tuple(sorted(receitas.get(id_, ()))), custos.get(id_) or 0.0)
+        for id_, categoria, nome_, valor, descricao in servicos
+    ]
+
+def consultar_servico(nome):
+    """Um serviço lido agora do banco (o primeiro com esse nome, como no filter_by().first()), ou None."""
+    return servicos_por_nome(consultar_servicos(nome)).get(nome)
+
+def servicos_por_nome(servicos):
+    por_nome = {}
+    for s in servicos:
+        por_nome.setdefault(s.nome, s) # Nomes repetidos: vale o primeiro, como no filter_by().first()
+    return por_nome
+
+class CacheCatalogo:
+    def __init__(self, ttl_segundos=300):
+        self.ttl_segundos = ttl_segundos
+        self._retrato = None
+        self._trava = threading.Lock()
+
+    def _carregar(self, versoes):
+        config = ConfiguracaoFinanceira.query.first()
+        # Instância transitória (fora da sessão): mesmas colunas, sem risco de ser gravada
+        copia_config = ConfiguracaoFinanceira(
+            **{col.name: getattr(config, col.name) for col in ConfiguracaoFinanceira.__table__.columns}
+        ) if config else None
+
+        servicos = consultar_servicos()
+        por_nome = servicos_por_nome(servicos)
+
+        return {
+            'versoes': versoes,
+            'expira_em': time.monotonic() + self.ttl_segundos,
+            'config': copia_config,
+            'servicos': servicos,
+            'por_nome': por_nome
+        }
+
+    def _atual(self):
+        try:
+            versoes = cache_paginas.versoes(TABELAS_CATALOGO)
+        except Exception as e:
+            # Redis fora do ar: vale só o TTL
+            print(f"Erro ao ler versões do catálogo: {e}")
+            versoes = None
+        retrato = self._retrato
+        if retrato and retrato['versoes'] == versoes and retrato['expira_em'] > time.monotonic():
+            return retrato
+        with self._trava:
+            retrato = self._retrato
+            if not (retrato and retrato['versoes'] == versoes and retrato['expira_em'] > time.monotonic()):
+                retrato = self._retrato = self._carregar(versoes)
+            return retrato
+
+    def config(self):
+        """ConfiguracaoFinanceira somente leitura (None se ainda não existe). Para editar, consulte o banco."""
+        return self._atual()['config']
+
+    def servicos(self):
+        return self._atual()['servicos']
+
+    def servico_por_nome(self, nome):
+        return self._atual()['por_nome'].get(nome)
+
+    def limpar(self):
+        self._retrato = None
+
+cache_catalogo = CacheCatalogo()
@@ -0,0 +1,38 @@
+import threading
+import time
+from collections import OrderedDict
+
+# ---------------------------
+# CACHE LRU EM MEMÓRIA (por processo)
+# ---------------------------
+class CacheLRU:
+    """Cache LRU com expiração por tempo, seguro para uso entre threads do mesmo worker."""
+
+    def __init__(self, tamanho_maximo=256, ttl_segundos=60):
+        self.tamanho_maximo = tamanho_maximo
+        self.ttl_segundos = ttl_segundos
+        self._itens = OrderedDict()
+        self._trava = threading.Lock()
+
+    def obter(self, chave, padrao=None):
+        with self._trava:
+            item = self._itens.get(chave)
+            if item is None:
+                return padrao
+            expira_em, valor = item
+            if expira_em < time.monotonic():
+                del self._itens[chave]
+                return padrao
+            self._itens.move_to_end(chave)
+            return valor
+
+    def guardar(self, chave, valor):
+        with self._trava:
+            self._itens[chave] = (time.monotonic() + self.ttl_segundos, valor)
+            self._itens.move_to_end(chave)
+            while len(self._itens) > self.tamanho_maximo:
+                self._itens.popitem(last=False)
+
+    def limpar(self):
+        with self._trava:
+            self._itens.clear()
@@ -0,0 +1,121 @@
+import threading
+from datetime import date
+from functools import wraps
+from flask import request, session, make_response
+from cache_local import CacheLRU
+
+try:
+    import redis
+except ImportError: # Sem o pacote o cache fica só em memória
+    redis = None
+
+# ---------------------------
+# CACHE DE PÁGINAS (HTML das telas de leitura)
+# ---------------------------
+# Cada página declara as tabelas de que depende (tags). Cada tag tem um número de versão que
+# entra na chave do cache; um commit que altera a tabela incrementa a versão, então as páginas
+# antigas simplesmente deixam de ser encontradas. Com CACHE_REDIS_URL o cache e as versões ficam
+# no Redis e valem para todos os workers. Sem Redis as versões são do processo, e um commit em
+# outra instância (serverless, vários workers) não invalidaria esta: o cache de páginas só liga
+# em memória quando pedido explicitamente (CACHE_PAGINAS=1, servidor de um processo só).
+
+class _BackendMemoria:
+    def __init__(self, tamanho_maximo, ttl_segundos):
+        self._paginas = CacheLRU(tamanho_maximo, ttl_segundos)
+        self._versoes = {}
+        self._trava = threading.Lock()
+
+    def versoes(self, tags):
+        with self._trava:
+            return [self._versoes.get(tag, 0) for tag in tags]
+
+    def incrementar(self, tags):
+        with self._trava:
+            for tag in tags:
+                self._versoes[tag] = self._versoes.get(tag, 0) + 1
+
+    def obter(self, chave):
+        return self._paginas.obter(chave)
+
+    def guardar(self, chave, corpo):
+        self._paginas.guardar(chave, corpo)
+
+class _BackendRedis:
+    def __init__(self, url, ttl_segundos):
+        self._cliente = redis.Redis.from_url(url)
+        self._ttl = ttl_segundos
+
+    def versoes(self, tags):
+        return [int(v or 0) for v in self._cliente.mget([f"cache:tag:{tag}" for tag in tags])]
+
+    def incrementar(self, tags):
+        pipe = self._cliente.pipeline()
+        for tag in tags:
+            pipe.incr(f"cache:tag:{tag}")
+        pipe.execute()
+
+    def obter(self, chave):
+        return self._cliente.get(f"cache:pagina:{chave}")
+
+    def guardar(self, chave, corpo):
+        self._cliente.setex(f"cache:pagina:{chave}", self._ttl, corpo)
+
+class CachePaginas:
+    def __init__(self, tamanho_maximo=128, ttl_segundos=300):
+        self.tamanho_maximo = tamanho_maximo
+        self.ttl_segundos = ttl_segundos
+        self.ativo = False
+        self._backend = _BackendMemoria(tamanho_maximo, ttl_segundos)
+
+    def configurar(self, redis_url=None, ativo=None):
+        """ativo=None: liga só com o Redis, o único backend em que as versões valem para todas as instâncias."""
+        if redis_url:
+            if redis is None:
+                print("CACHE_REDIS_URL definido, mas o pacote redis não está instalado. Cache de páginas desligado.")
+            else:
+                self._backend = _BackendRedis(redis_url, self.ttl_segundos)
+        self.ativo = isinstance(self._backend, _BackendRedis) if ativo is None else ativo
+
+    def versoes(self, tags):
+        """Versão atual de cada tag (usada também por outros caches derivados das mesmas tabelas)."""
+        return self._backend.versoes(tags)
+
+    def invalidar(self, tags):
+        try:
+            self._backend.incrementar(sorted(tags))
+        except Exception as e:
+            print(f"Erro ao invalidar cache de páginas: {e}")
+
+    def _chave(self, tags):
+        # Páginas dependem da data de hoje (agenda do dia, ciclo financeiro atual)
+        parametros = '&'.join(f"{k}={v}" for k, v in sorted(request.args.items(multi=True)))
+        versoes = '.'.join(str(v) for v in self.versoes(tags))
+        return f"{request.path}?{parametros}|{date.today().isoformat()}|{versoes}"
+
+    def pagina(self, *tags):
+        """Decorator: serve GETs do cache. Requisições com mensagens flash pendentes nunca usam o cache."""
+        def decorador(view):
+            @wraps(view)
+            def envoltorio(*args, **kwargs):
+                if not self.ativo or request.method != 'GET' or session.get('_flashes'):
+                    return view(*args, **kwargs)
+                try:
+                    chave = self._chave(tags)
+                    corpo = self._backend.obter(chave)
+                except Exception as e:
+                    print(f"Erro ao ler cache de páginas: {e}")
+                    return view(*args, **kwargs)
+                if corpo is not None:
+                    return make_response(corpo)
+
+                resposta = make_response(view(*args, **kwargs))
+                if resposta.status_code == 200 and resposta.mimetype == 'text/html':
+                    try:
+                        self._backend.guardar(chave, resposta.get_data())
+                    except Exception as e:
+                        print(f"Erro ao gravar cache de páginas: {e}")
+                return resposta
+            return envoltorio
+        return decorador
+
+cache_paginas = CachePaginas()
@@ -0,0 +1,146 @@
+from sqlalchemy import insert
+from database import db, Produto, Servico, ConfiguracaoFinanceira, SementeAplicada, servico_produto_assoc
+
+# ---------------------------
+# CATÁLOGO PADRÃO (Produtos, Serviços e Configuração Inicial)
+# ---------------------------
+
+# Incrementar quando o catálogo padrão mudar: a próxima inicialização insere apenas o que faltar
+VERSAO_SEMENTE_CATALOGO = 1
+
+# (nome, unidade, gasto médio por lavagem, custo de compra, quantidade de compra)
+PRODUTOS_PADRAO = [
+    ("Moto-V", "ml", 10.0, 64.50, 500.0),
+    ("Rexer", "ml", 30.0, 54.90, 500.0),
+    ("V-Mol", "ml", 10.0, 94.03, 500.0),
+    ("V-Floc", "ml", 5.0, 114.90, 500.0),
+    ("Vexus", "ml", 25.0, 81.90, 500.0),
+    ("Sintra Fast", "ml", 15.0, 80.70, 500.0),
+    ("Izer", "ml", 30.0, 122.90, 500.0),
+    ("Strike", "ml", 5.0, 130.00, 500.0),
+    ("Delet", "ml", 20.0, 92.30, 500.0),
+    ("V-Bar", "g", 2.0, 20.00, 50.0),
+    ("V-Lub", "ml", 40.0, 20.00, 500.0),
+    ("Revelax", "ml", 20.0, 95.90, 500.0),
+    ("V-Polish", "ml", 10.0, 115.20, 500.0),
+    ("Blend (Spray)", "ml", 10.0, 47.93, 500.0),
+    ("Native (Paste)", "g", 3.0, 54.00, 100.0),
+    ("Tok Final", "ml", 15.0, 25.30, 500.0),
+    ("V-80", "ml", 10.0, 55.80, 500.0),
+    ("SIO2-PRO", "ml", 10.0, 43.90, 500.0),
+    ("Verniz Motor", "ml", 40.0, 89.50, 500.0),
+    ("Verom", "ml", 30.0, 75.79, 500.0),
+    ("Restaurax", "ml", 10.0, 115.90, 500.0),
+    ("Revox", "ml", 5.0, 42.50, 500.0),
+    ("Shiny", "ml", 5.0, 151.00, 500.0),
+    ("Glazy", "ml", 10.0, 27.76, 500.0),
+    ("Prizm", "ml", 5.0, 33.00, 500.0),
+    ("Aquaglass", "ml", 3.0, 30.00, 50.0),
+    ("V-Paint", "ml", 10.0, 74.30, 50.0),
+    ("V-Plastic", "ml", 10.0, 63.90, 50.0),
+    ("V-Energy", "ml", 5.0, 125.50, 50.0),
+    ("V-Light", "ml", 2.0, 61.50, 50.0),
+    ("V-Leather", "ml", 5.0, 138.90, 50.0),
+    ("V-Wheels", "ml", 10.0, 50.00, 50.0),
+    ("Ziva", "ml", 10.0, 50.00, 50.0)
+]
+
+# Vitrificadores ficam de fora da receita dos serviços Standard
+VITRIFICADORES = ['V-Paint', 'V-Plastic', 'V-Energy', 'V-Light', 'V-Leather']
+
+SERVICOS_PADRAO = [
+    ('Naked', 'Standard Naked', 50.00, 'Lavagem detalhada básica'),
+    ('Naked', 'Premium Naked', 90.00, 'Lavagem com enceramento e proteção vitrificada'),
+    ('Sport', 'Standard Sport', 70.00, 'Lavagem detalhada básica'),
+    ('Sport', 'Premium Sport', 120.00, 'Lavagem com enceramento e proteção vitrificada'),
+    ('Custom', 'Standard Custom', 80.00, 'Lavagem detalhada básica com polimento de cromados leves'),
+    ('Custom', 'Premium Custom', 150.00, 'Lavagem completa com proteção avançada de metais e vitrificadores'),
+    ('BigTrail', 'Standard Trail', 60.00, 'Lavagem para remoção de terra e barro leve'),
+    ('BigTrail', 'Premium Trail', 110.00, 'Lavagem profunda desincrustante e proteção plástica premium')
+]
+
+def _produto_semente(nome_produto):
+    # Mesmo critério do cadastro antigo: o produto existente começa com o nome do catálogo
+    nome = nome_produto.lower()
+    for item in PRODUTOS_PADRAO:
+        if nome.startswith(item[0].lower()):
+            return item
+    return None
+
+def _inserir_produtos_faltantes(produtos_existentes):
+    presentes = {_produto_semente(p.nome)[0] for p in produtos_existentes if _produto_semente(p.nome)}
+    novos = [
+        dict(nome=nome, unidade_medida=un, estoque_atual=0.0, custo_compra=custo, quantidade_compra=qtd,
+             gasto_medio_lavagem=gasto, ponto_pedido=5.0, link_compra="")
+        for nome, un, gasto, custo, qtd in PRODUTOS_PADRAO if nome not in presentes
+    ]
+    if novos:
+        db.session.execute(insert(Produto), novos)
+    return len(novos)
+
+def _vincular_receitas_vazias():
+    """Vincula a receita padrão aos serviços Standard/Premium sem nenhum produto, com um único insert em lote."""
+    servicos = db.session.query(Servico.id, Servico.nome).all()
+    com_receita = {sid for (sid,) in db.session.query(servico_produto_assoc.c.servico_id).distinct()}
+    produtos = db.session.query(Produto.id, Produto.nome).all()
+    ids_standard = [pid for pid, nome in produtos if nome not in VITRIFICADORES]
+    ids_premium = [pid for pid, _ in produtos]
+
+    vinculos = []
+    for sid, nome in servicos:
+        if sid in com_receita:
+            continue
+        if 'Standard' in nome:
+            vinculos.extend({'servico_id': sid, 'produto_id': pid} for pid in ids_standard)
+        elif 'Premium' in nome:
+            vinculos.extend({'servico_id': sid, 'produto_id': pid} for pid in ids_premium)
+    if vinculos:
+        db.session.execute(insert(servico_produto_assoc), vinculos)
+
+def semear_catalogo():
+    """Cria configuração, produtos e serviços padrão uma única vez por versão da semente."""
+    try:
+        semente = db.session.get(SementeAplicada, 'catalogo')
+        if semente and semente.versao >= VERSAO_SEMENTE_CATALOGO:
+            return
+
+        if ConfiguracaoFinanceira.query.first() is None:
+            db.session.add(ConfiguracaoFinanceira())
+            print("--- Configurações Financeiras Iniciais Criadas ---")
+
+        count_novos = _inserir_produtos_faltantes(db.session.query(Produto.nome).all())
+
+        if Servico.query.first() is None:
+            db.session.execute(insert(Servico), [
+                dict(categoria=cat, nome=nome, valor=valor, descricao=desc) for cat, nome, valor, desc in SERVICOS_PADRAO
+            ])
+        _vincular_receitas_vazias()
+
+        if semente:
+            semente.versao = VERSAO_SEMENTE_CATALOGO
+        else:
+            db.session.add(SementeAplicada(nome='catalogo', versao=VERSAO_SEMENTE_CATALOGO))
+        db.session.commit()
+        if count_novos > 0:
+            print(f"--- {count_novos} Produtos Iniciais Cadastrados ---")
+    except Exception as e:
+        db.session.rollback()
+        print(f"Erro ao semear catálogo: {e}")
+
+def ressincronizar_catalogo():
+    """
+    Reaplica o catálogo padrão sobre o banco: restaura nomes, custos e doses dos produtos
+    padrão (sobrescrevendo edições), cadastra os que faltarem e vincula receitas vazias.
+    """
+    produtos = Produto.query.all()
+    atualizados = 0
+    for p in produtos:
+        item = _produto_semente(p.nome)
+        if item:
+            p.nome, _, p.gasto_medio_lavagem, p.custo_compra, p.quantidade_compra = item
+            atualizados += 1
+    db.session.flush()
+    novos = _inserir_produtos_faltantes(produtos)
+    _vincular_receitas_vazias()
+    db.session.commit()
+    return atualizados, novos
@@ -0,0 +1,115 @@
+from datetime import datetime, date, timedelta
+from functools import lru_cache
+
+# ---------------------------
+# CICLO FINANCEIRO (Fecha no 4º dia útil de cada mês)
+# ---------------------------
+
+# Feriados adicionais (municipais/estaduais ou exceções) configurados pela aplicação
+_feriados_extras = frozenset()
+_usar_feriados_nacionais = True
+
+def _pascoa(ano):
+    # Algoritmo de Meeus/Jones/Butcher para o domingo de Páscoa (calendário gregoriano)
+    a = ano % 19
+    b, c = divmod(ano, 100)
+    d, e = divmod(b, 4)
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    mes, dia = divmod(h + l - 7 * m + 114, 31)
+    return date(ano, mes, dia + 1)
+
+@lru_cache(maxsize=None)
+def feriados_bancarios(ano):
+    """Feriados sem expediente bancário no ano (nacionais + extras configurados)."""
+    feriados = {d for d in _feriados_extras if d.year == ano}
+    if _usar_feriados_nacionais:
+        pascoa = _pascoa(ano)
+        feriados.update({
+            date(ano, 1, 1), date(ano, 4, 21), date(ano, 5, 1), date(ano, 9, 7),
+            date(ano, 10, 12), date(ano, 11, 2), date(ano, 11, 15), date(ano, 12, 25),
+            pascoa - timedelta(days=48), # Carnaval (segunda)
+            pascoa - timedelta(days=47), # Carnaval (terça)
+            pascoa - timedelta(days=2),  # Sexta-feira Santa
+            pascoa + timedelta(days=60)  # Corpus Christi
+        })
+        if ano >= 2024:
+            feriados.add(date(ano, 11, 20)) # Consciência Negra (nacional desde 2024)
+    return frozenset(feriados)
+
+def configurar_feriados(extras='', nacionais=True):
+    """
+    Define o calendário de feriados usado no cálculo do 4º dia útil.
+    `extras` aceita uma lista de datas ou uma string 'AAAA-MM-DD,AAAA-MM-DD'.
+    """
+    global _feriados_extras, _usar_feriados_nacionais
+    if isinstance(extras, str):
+        extras = [datetime.strptime(d.strip(), '%Y-%m-%d').date() for d in extras.split(',') if d.strip()]
+    _feriados_extras = frozenset(extras)
+    _usar_feriados_nacionais = nacionais
+    # O calendário memorizado depende dos feriados: descarta tudo que foi calculado antes
+    feriados_bancarios.cache_clear()
+    get_quarto_dia_util.cache_clear()
+    _ciclo_da_data.cache_clear()
+    limites_ciclo.cache_clear()
+
+@lru_cache(maxsize=None)
+def get_quarto_dia_util(ano, mes):
+    feriados = feriados_bancarios(ano)
+    dias_uteis = 0
+    dia = 1
+    while dias_uteis < 4:
+        dt = date(ano, mes, dia)
+        if dt.weekday() < 5 and dt not in feriados: # 0 a 4 são Segunda a Sexta
+            dias_uteis += 1
+        if dias_uteis < 4:
+            dia += 1
+    return date(ano, mes, dia)
+
+def get_mes_anterior(ano, mes):
+    if mes == 1: return ano - 1, 12
+    return ano, mes - 1
+
+def get_proximo_mes(ano, mes):
+    if mes == 12: return ano + 1, 1
+    return ano, mes + 1
+    
+def obter_ciclo_atual(data_ref=None):
+    if not data_ref:
+        data_ref = datetime.now().date()
+    return _ciclo_da_data(data_ref)
+
+@lru_cache(maxsize=4096)
+def _ciclo_da_data(data_ref):
+    quarto_dia_atual = get_quarto_dia_util(data_ref.year, data_ref.month)
+    
+    if data_ref <= quarto_dia_atual:
+        ano_ant, mes_ant = get_mes_anterior(data_ref.year, data_ref.month)
+        quarto_dia_ant = get_quarto_dia_util(ano_ant, mes_ant)
+        
+        data_inicio = quarto_dia_ant + timedelta(days=1)
+        data_fim = quarto_dia_atual
+        mes_referencia = f"{ano_ant}-{mes_ant:02d}"
+        mes_anterior_str = f"{get_mes_anterior(ano_ant, mes_ant)[0]}-{get_mes_anterior(ano_ant, mes_ant)[1]:02d}"
+    else:
+        ano_prox, mes_prox = get_proximo_mes(data_ref.year, data_ref.month)
+        quarto_dia_prox = get_quarto_dia_util(ano_prox, mes_prox)
+        
+        data_inicio = quarto_dia_atual + timedelta(days=1)
+        data_fim = quarto_dia_prox
+        mes_referencia = f"{data_ref.year}-{data_ref.month:02d}"
+        mes_anterior_str = f"{get_mes_anterior(data_ref.year, data_ref.month)[0]}-{get_mes_anterior(data_ref.year, data_ref.month)[1]:02d}"
+        
+    return data_inicio, data_fim, mes_referencia, mes_anterior_str
+
+@lru_cache(maxsize=None)
+def limites_ciclo(ano, mes):
+    """Retorna (data_inicio, data_fim) do ciclo cujo mês de referência é ano-mes."""
+    ano_prox, mes_prox = get_proximo_mes(ano, mes)
+    data_inicio = get_quarto_dia_util(ano, mes) + timedelta(days=1)
+    data_fim = get_quarto_dia_util(ano_prox, mes_prox)
+    return data_inicio, data_fim
@@ -1,8 +1,27 @@
+import re
+import unicodedata
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
 from datetime import datetime
 
 db = SQLAlchemy()
 
+# Status que contam como serviço realizado (faturamento, LTV, indicações)
+STATUS_CONCLUIDOS = ('Lavagem Concluída', 'Retirado')
+
+# ---------------------------
+# NORMALIZAÇÃO PARA BUSCA
+# ---------------------------
+def normalizar_texto(valor):
+    """Minúsculas, sem acentos e com espaços colapsados ('João  Silva' -> 'joao silva')."""
+    if not valor:
+        return ''
+    sem_acentos = ''.join(ch for ch in unicodedata.normalize('NFKD', valor) if not unicodedata.combining(ch))
+    return ' '.join(sem_acentos.lower().split())
+
+def apenas_digitos(valor):
+    return re.sub(r'\D', '', valor or '')
+
 # ---------------------------
 # TABELA DE ASSOCIAÇÃO: SERVIÇO <-> PRODUTO
 # ---------------------------
@@ -23,6 +42,10 @@ class Cliente(db.Model):
     endereco = db.Column(db.String(200), nullable=True)
     data_cadastro = db.Column(db.DateTime, default=datetime.utcnow)
     
+    # Colunas derivadas para a busca indexada (preenchidas automaticamente no flush)
+    nome_busca = db.Column(db.String(100), nullable=True, index=True)
+    telefone_digitos = db.Column(db.String(20), nullable=True, index=True)
+    
     indicado_por_id = db.Column(db.Integer, db.ForeignKey('clientes.id'), nullable=True)
     
     # Alterado para Inteiro para gerenciar fila de descontos (1 uso por vez)
@@ -33,6 +56,14 @@ class Cliente(db.Model):
     feedback_texto = db.Column(db.Text, nullable=True)
     feedback_estrelas = db.Column(db.Integer, default=0)
     
+    # Agregados mantidos a cada mudança de status (agregados_clientes.py); `flask reconstruir-clientes` confere
+    qtd_lavagens = db.Column(db.Integer, default=0)
+    qtd_canceladas = db.Column(db.Integer, default=0)
+    total_gasto = db.Column(db.Float, default=0.0)
+    ultima_visita = db.Column(db.DateTime, nullable=True)
+    # Marcado na primeira lavagem concluída; é quando o padrinho ganha o desconto (uma única vez)
+    primeira_lavagem_concluida = db.Column(db.Boolean, default=False)
+    
     motos = db.relationship('Moto', backref='dono', lazy=True)
     agendamentos = db.relationship('Agendamento', backref='cliente', lazy=True)
     indicacoes = db.relationship('Cliente', backref=db.backref('padrinho', remote_side=[id]), lazy=True)
@@ -48,6 +79,38 @@ class Cliente(db.Model):
             'preferencias': self.preferencias if self.preferencias else ""
         }
 
+# Ranking da tela de clientes (ORDER BY total_gasto DESC, nome)
+db.Index('ix_clientes_ranking', Cliente.total_gasto.desc(), Cliente.nome)
+
+# ---------------------------
+# MODELO: ÁRVORE DE INDICAÇÕES (tabela de fechamento de indicado_por_id)
+# ---------------------------
+class IndicacaoArvore(db.Model):
+    """Uma linha por par ancestral/descendente (inclui o próprio cliente com profundidade 0)."""
+    __tablename__ = 'indicacao_arvore'
+
+    ancestral_id = db.Column(db.Integer, db.ForeignKey('clientes.id', ondelete='CASCADE'), primary_key=True)
+    descendente_id = db.Column(db.Integer, db.ForeignKey('clientes.id', ondelete='CASCADE'), primary_key=True, index=True)
+    profundidade = db.Column(db.Integer, nullable=False)
+
+@event.listens_for(Cliente, 'after_insert')
+def ligar_na_arvore_indicacoes(mapper, connection, cliente):
+    # O padrinho só é definido no cadastro: a árvore cresce por folhas, na mesma transação do INSERT
+    arvore = IndicacaoArvore.__table__
+    connection.execute(arvore.insert().values(ancestral_id=cliente.id, descendente_id=cliente.id, profundidade=0))
+    if cliente.indicado_por_id:
+        connection.execute(arvore.insert().from_select(
+            ['ancestral_id', 'descendente_id', 'profundidade'],
+            db.select(arvore.c.ancestral_id, db.literal(cliente.id), arvore.c.profundidade + 1)
+            .where(arvore.c.descendente_id == cliente.indicado_por_id)
+        ))
+
+@event.listens_for(Cliente, 'before_insert')
+@event.listens_for(Cliente, 'before_update')
+def atualizar_campos_busca(mapper, connection, cliente):
+    cliente.nome_busca = normalizar_texto(cliente.nome)
+    cliente.telefone_digitos = apenas_digitos(cliente.telefone)
+
 # ---------------------------
 # MODELO: VEÍCULOS (Motos)
 # ---------------------------
@@ -55,7 +118,7 @@ class Moto(db.Model):
     __tablename__ = 'motos'
     
     id = db.Column(db.Integer, primary_key=True)
-    cliente_id = db.Column(db.Integer, db.ForeignKey('clientes.id'), nullable=False)
+    cliente_id = db.Column(db.Integer, db.ForeignKey('clientes.id'), nullable=False, index=True)
     placa = db.Column(db.String(10), nullable=True)
     modelo = db.Column(db.String(50), nullable=False)
     marca = db.Column(db.String(50), nullable=True)
@@ -76,6 +139,10 @@ class Moto(db.Model):
 # ---------------------------
 class Produto(db.Model):
     __tablename__ = 'produtos'
+    __table_args__ = (
+        # Índice de expressão para o alerta de reposição (estoque_atual - ponto_pedido <= 0)
+        db.Index('ix_produtos_saldo_reposicao', db.text('(estoque_atual - ponto_pedido)')),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     nome = db.Column(db.String(100), nullable=False)
@@ -95,6 +162,49 @@ class Produto(db.Model):
             return (self.custo_compra / self.quantidade_compra) * self.gasto_medio_lavagem
         return 0.0
 
+# ---------------------------
+# MODELO: MOVIMENTOS DE ESTOQUE (livro-razão de cada entrada/saída de produto)
+# ---------------------------
+class MovimentoEstoque(db.Model):
+    __tablename__ = 'movimento_estoque'
+    __table_args__ = (
+        db.Index('ix_movimento_estoque_produto_data', 'produto_id', 'data'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    # SET NULL: excluir produto/agendamento não apaga o histórico
+    produto_id = db.Column(db.Integer, db.ForeignKey('produtos.id', ondelete='SET NULL'), nullable=True)
+    agendamento_id = db.Column(db.Integer, db.ForeignKey('agendamentos.id', ondelete='SET NULL'), nullable=True, index=True)
+    tipo = db.Column(db.String(20), nullable=False) # saldo_inicial, cadastro, consumo, ajuste
+    quantidade = db.Column(db.Float, nullable=False) # Positiva entra, negativa sai
+    data = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    produto = db.relationship('Produto')
+
+class SaldoEstoque(db.Model):
+    """Foto do saldo de um produto em um corte (inclui todos os movimentos com data <= data_corte)."""
+    __tablename__ = 'saldo_estoque'
+
+    produto_id = db.Column(db.Integer, db.ForeignKey('produtos.id', ondelete='CASCADE'), primary_key=True)
+    data_corte = db.Column(db.DateTime, primary_key=True)
+    saldo = db.Column(db.Float, nullable=False)
+
+# ---------------------------
+# MODELO: ESTATÍSTICAS DE DURAÇÃO (tempo_inicio -> tempo_fim, mantidas a cada lavagem concluída)
+# ---------------------------
+class EstatisticaDuracao(db.Model):
+    __tablename__ = 'estatistica_duracao'
+
+    tipo_servico = db.Column(db.String(100), primary_key=True)
+    categoria = db.Column(db.String(20), primary_key=True) # 'Todas' = agregado do serviço
+    quantidade = db.Column(db.Integer, default=0, nullable=False)
+    soma_minutos = db.Column(db.Float, default=0.0, nullable=False)
+    media_minutos = db.Column(db.Float, nullable=True)
+    p50_minutos = db.Column(db.Float, nullable=True)
+    p90_minutos = db.Column(db.Float, nullable=True)
+    histograma = db.Column(db.Text, nullable=True) # JSON {faixa: quantidade}, faixas de 5 min
+    atualizado_em = db.Column(db.DateTime, default=datetime.utcnow)
+
 # ---------------------------
 # MODELO: SERVIÇOS (Preços Editáveis e Receita de Produtos)
 # ---------------------------
@@ -103,12 +213,13 @@ class Servico(db.Model):
     
     id = db.Column(db.Integer, primary_key=True)
     categoria = db.Column(db.String(50), nullable=False) # Ex: Naked, Sport
-    nome = db.Column(db.String(100), nullable=False)     # Ex: Standard Naked
+    nome = db.Column(db.String(100), nullable=False, index=True) # Ex: Standard Naked
     valor = db.Column(db.Float, nullable=False)          # Ex: 50.00
     descricao = db.Column(db.Text, nullable=True)        # Ex: Detalhamento do que é feito na lavagem
     
-    # Relacionamento com os Produtos (Receita do Serviço)
-    produtos_vinculados = db.relationship('Produto', secondary=servico_produto_assoc, lazy='subquery',
+    # Relacionamento com os Produtos (Receita do Serviço). Carregado só quando acessado: o custo
+    # da receita para leitura vem pronto de cache_catalogo.py
+    produtos_vinculados = db.relationship('Produto', secondary=servico_produto_assoc, lazy='select',
         backref=db.backref('servicos', lazy=True))
 
 # ---------------------------
@@ -116,6 +227,12 @@ class Servico(db.Model):
 # ---------------------------
 class Agendamento(db.Model):
     __tablename__ = 'agendamentos'
+    __table_args__ = (
+        # Agenda/financeiro: intervalo de datas + status
+        db.Index('ix_agendamentos_data_status', 'data_agendada', 'status'),
+        # Contagem de lavagens por cliente (indicações, CRM)
+        db.Index('ix_agendamentos_cliente_status', 'cliente_id', 'status'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     cliente_id = db.Column(db.Integer, db.ForeignKey('clientes.id'), nullable=False)
@@ -156,9 +273,18 @@ class MidiaAgendamento(db.Model):
     __tablename__ = 'midia_agendamento'
     
     id = db.Column(db.Integer, primary_key=True)
-    agendamento_id = db.Column(db.Integer, db.ForeignKey('agendamentos.id'), nullable=False)
-    caminho_arquivo = db.Column(db.String(300), nullable=False)
+    agendamento_id = db.Column(db.Integer, db.ForeignKey('agendamentos.id'), nullable=False, index=True)
+    # Chave no armazenamento: sha256 do conteúdo + extensão (uploads antigos usam nome com timestamp)
+    caminho_arquivo = db.Column(db.String(300), nullable=False, index=True)
+    # Derivados leves (JPEG sem EXIF) gerados em segundo plano; vazios enquanto pendentes e em uploads antigos
+    caminho_miniatura = db.Column(db.String(300), nullable=True)
+    caminho_web = db.Column(db.String(300), nullable=True)
+    tamanho_bytes = db.Column(db.Integer, nullable=True)
     tipo = db.Column(db.String(10), nullable=False)
+    # pendente -> processando -> concluido | erro (ver fila_midias.py)
+    status_processamento = db.Column(db.String(15), default='concluido', index=True)
+    # Horário da reserva pelo worker; 'processando' além do prazo é considerado abandonado
+    processamento_iniciado_em = db.Column(db.DateTime, nullable=True)
     data_upload = db.Column(db.DateTime, default=datetime.utcnow)
 
 # ---------------------------
@@ -186,6 +312,11 @@ class ConfiguracaoFinanceira(db.Model):
     
     # Operação
     capacidade_mensal = db.Column(db.Integer, default=40)
+    boxes_lavagem = db.Column(db.Integer, default=1) # Lavagens simultâneas
+    horario_abertura = db.Column(db.String(5), default='08:00')
+    horario_fechamento = db.Column(db.String(5), default='18:00')
+    intervalo_slots_minutos = db.Column(db.Integer, default=30)
+    duracao_padrao_minutos = db.Column(db.Integer, default=60) # Serviços sem histórico de tempo
     
     # --- CAPEX E CAPITAL INICIAL (Gestão Patrimonial) ---
     aporte_erick = db.Column(db.Float, default=0.0)
@@ -213,3 +344,28 @@ class FechamentoMensal(db.Model):
     
     # --- Retiradas Extras (Distribuição de Lucros além do Pró-labore no mês) ---
     retiradas_extras = db.Column(db.Float, default=0.0)
+    
+    # --- Saldos Acumulados (histórico até este fechamento, inclusive) ---
+    # Mantidos a cada novo fechamento para que o patrimônio seja lido do último registro sem varrer o histórico
+    lucro_acumulado = db.Column(db.Float, nullable=True)
+    retiradas_acumuladas = db.Column(db.Float, nullable=True)
+
+# ---------------------------
+# MODELO: VERSÃO DO SCHEMA (MIGRAÇÕES APLICADAS)
+# ---------------------------
+class SchemaVersao(db.Model):
+    __tablename__ = 'schema_versao'
+    
+    versao = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    descricao = db.Column(db.String(200), nullable=True)
+    data_aplicacao = db.Column(db.DateTime, default=datetime.utcnow)
+
+# ---------------------------
+# MODELO: SEMENTES APLICADAS (DADOS PADRÃO JÁ CARREGADOS)
+# ---------------------------
+class SementeAplicada(db.Model):
+    __tablename__ = 'semente_aplicada'
+    
+    nome = db.Column(db.String(50), primary_key=True) # Ex: 'catalogo'
+    versao = db.Column(db.Integer, nullable=False)
+    data_aplicacao = db.Column(db.DateTime, default=datetime.utcnow)
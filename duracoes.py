@@ -0,0 +1,109 @@
+import json
+from datetime import datetime
+from sqlalchemy import select, func
+from database import db, EstatisticaDuracao
+
+# ---------------------------
+# ESTATÍSTICAS DE DURAÇÃO DOS SERVIÇOS
+# ---------------------------
+# Cada 'Lavagem Concluída' soma sua duração (tempo_inicio -> tempo_fim) a duas linhas de
+# estatistica_duracao: a do serviço na categoria da moto e a agregada ('Todas'). Os percentis
+# saem de um histograma em faixas de 5 minutos guardado na própria linha, então a atualização
+# custa o mesmo com 10 ou 10 mil lavagens no histórico.
+
+FAIXA_MINUTOS = 5
+LIMITE_MINUTOS = 600 # Durações maiores caem na última faixa
+TODAS_CATEGORIAS = 'Todas'
+
+def duracao_minutos(inicio, fim):
+    if inicio and fim and fim > inicio:
+        return (fim - inicio).total_seconds() / 60
+    return None
+
+def _quantil(histograma, total, q):
+    # Ponto médio da faixa que contém o q-ésimo valor (erro máximo de meia faixa)
+    alvo = q * total
+    acumulado = 0
+    for faixa in sorted(histograma):
+        acumulado += histograma[faixa]
+        if acumulado >= alvo:
+            return (faixa + 0.5) * FAIXA_MINUTOS
+    return None
+
+def _acumular(estatistica, minutos):
+    histograma = {int(faixa): qtd for faixa, qtd in json.loads(estatistica.histograma or '{}').items()}
+    faixa = min(int(minutos // FAIXA_MINUTOS), LIMITE_MINUTOS // FAIXA_MINUTOS)
+    histograma[faixa] = histograma.get(faixa, 0) + 1
+
+    estatistica.quantidade = (estatistica.quantidade or 0) + 1
+    estatistica.soma_minutos = (estatistica.soma_minutos or 0.0) + minutos
+    estatistica.media_minutos = estatistica.soma_minutos / estatistica.quantidade
+    estatistica.p50_minutos = _quantil(histograma, estatistica.quantidade, 0.5)
+    estatistica.p90_minutos = _quantil(histograma, estatistica.quantidade, 0.9)
+    estatistica.histograma = json.dumps(histograma, separators=(',', ':'))
+    estatistica.atualizado_em = datetime.utcnow()
+
+def _categorias(categoria):
+    return (categoria or 'Outras', TODAS_CATEGORIAS)
+
+def _linha_travada(tipo_servico, categoria):
+    dialeto = db.engine.dialect.name
+    if dialeto == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as insert_dialeto
+    elif dialeto == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as insert_dialeto
+    else:
+        insert_dialeto = None
+    if insert_dialeto:
+        # Garante a linha sem disputar a criação com outro worker; o FOR UPDATE serializa a soma
+        db.session.execute(insert_dialeto(EstatisticaDuracao).values(
+            tipo_servico=tipo_servico, categoria=categoria, quantidade=0, soma_minutos=0.0
+        ).on_conflict_do_nothing())
+    estatistica = db.session.execute(
+        select(EstatisticaDuracao)
+        .where(EstatisticaDuracao.tipo_servico == tipo_servico, EstatisticaDuracao.categoria == categoria)
+        .with_for_update()
+        .execution_options(populate_existing=True)
+    ).scalar_one_or_none()
+    if estatistica is None:
+        estatistica = EstatisticaDuracao(tipo_servico=tipo_servico, categoria=categoria, quantidade=0, soma_minutos=0.0)
+        db.session.add(estatistica)
+    return estatistica
+
+def registrar_duracao(agendamento):
+    """Soma a duração de uma lavagem recém-concluída às estatísticas (commit fica com quem chamou)."""
+    minutos = duracao_minutos(agendamento.tempo_inicio, agendamento.tempo_fim)
+    if minutos is None or not agendamento.tipo_servico:
+        return False
+    categoria = agendamento.moto.categoria if agendamento.moto else None
+    for cat in _categorias(categoria):
+        _acumular(_linha_travada(agendamento.tipo_servico, cat), minutos)
+    return True
+
+def calcular_estatisticas(lavagens):
+    """Estatísticas completas a partir de [(tipo_servico, categoria, tempo_inicio, tempo_fim)] (usado na migração)."""
+    linhas = {}
+    for tipo_servico, categoria, inicio, fim in lavagens:
+        minutos = duracao_minutos(inicio, fim)
+        if minutos is None or not tipo_servico:
+            continue
+        for cat in _categorias(categoria):
+            chave = (tipo_servico, cat)
+            if chave not in linhas:
+                linhas[chave] = EstatisticaDuracao(tipo_servico=tipo_servico, categoria=cat)
+            _acumular(linhas[chave], minutos)
+    colunas = EstatisticaDuracao.__table__.columns
+    return [{col.name: getattr(e, col.name) for col in colunas} for e in linhas.values()]
+
+def duracoes_p50():
+    """{tipo_servico: mediana em minutos} de todas as categorias."""
+    return dict(db.session.query(EstatisticaDuracao.tipo_servico, EstatisticaDuracao.p50_minutos).filter(
+        EstatisticaDuracao.categoria == TODAS_CATEGORIAS
+    ).all())
+
+def duracao_media_geral():
+    """Minutos médios por lavagem considerando todos os serviços (None sem histórico)."""
+    quantidade, soma = db.session.query(
+        func.sum(EstatisticaDuracao.quantidade), func.sum(EstatisticaDuracao.soma_minutos)
+    ).filter(EstatisticaDuracao.categoria == TODAS_CATEGORIAS).one()
+    return soma / quantidade if quantidade else None
@@ -0,0 +1,127 @@
+from datetime import datetime, time, timedelta, timezone
+from sqlalchemy import update, insert, select, func, and_, or_
+from database import db, Produto, MovimentoEstoque, SaldoEstoque
+
+# ---------------------------
+# MOVIMENTAÇÃO DE ESTOQUE
+# ---------------------------
+# Toda alteração de estoque_atual passa por aqui e deixa um lançamento em movimento_estoque,
+# de forma que a soma dos movimentos de um produto é sempre igual ao seu saldo.
+# saldo_estoque guarda fotos diárias do saldo: o saldo em qualquer data é a última foto
+# anterior mais os poucos movimentos depois dela, sem reler o histórico inteiro.
+
+def _lancar(movimentos, agendamento_id, tipo, sinal):
+    if movimentos:
+        agora = datetime.utcnow()
+        db.session.execute(insert(MovimentoEstoque), [
+            dict(produto_id=produto_id, agendamento_id=agendamento_id, tipo=tipo, quantidade=sinal * quantidade, data=agora)
+            for produto_id, quantidade in movimentos
+        ])
+
+def baixar_receita(produtos_ids, agendamento_id=None):
+    """
+    Baixa a dose de cada produto da receita com um único UPDATE no banco (sem ler-alterar-gravar
+    em Python, então lavagens concluídas ao mesmo tempo não perdem baixas). Retorna [(produto_id, dose)].
+    """
+    if not produtos_ids:
+        return []
+    baixas = db.session.execute(
+        update(Produto)
+        .where(Produto.id.in_(produtos_ids))
+        .values(estoque_atual=Produto.estoque_atual - Produto.gasto_medio_lavagem)
+        .returning(Produto.id, Produto.gasto_medio_lavagem)
+        .execution_options(synchronize_session=False)
+    ).all()
+    _lancar(baixas, agendamento_id, 'consumo', -1)
+    return baixas
+
+def registrar_compra(produto_id, quantidade):
+    """Entrada de mercadoria somada no banco (mesma garantia da baixa). Retorna False se o produto não existe."""
+    entradas = db.session.execute(
+        update(Produto)
+        .where(Produto.id == produto_id)
+        .values(estoque_atual=func.coalesce(Produto.estoque_atual, 0.0) + quantidade)
+        .returning(Produto.id)
+        .execution_options(synchronize_session=False)
+    ).all()
+    _lancar([(pid, quantidade) for (pid,) in entradas], None, 'compra', 1)
+    return bool(entradas)
+
+def definir_saldo(produto, novo_saldo, tipo='ajuste'):
+    """Acerto manual (contagem, cadastro, zeragem): lança a diferença para o saldo informado."""
+    diferenca = (novo_saldo or 0.0) - (produto.estoque_atual or 0.0)
+    produto.estoque_atual = novo_saldo
+    if diferenca:
+        db.session.add(MovimentoEstoque(produto=produto, tipo=tipo, quantidade=diferenca))
+
+# --- Fotos de saldo ---
+
+# Folga após a meia-noite antes de fotografar o dia: transações abertas na virada já terão commitado
+FOLGA_CORTE = timedelta(hours=1)
+
+def _ultimo_corte(data):
+    return select(
+        SaldoEstoque.produto_id, func.max(SaldoEstoque.data_corte).label('data_corte')
+    ).where(SaldoEstoque.data_corte <= data).group_by(SaldoEstoque.produto_id).subquery()
+
+def _fotos_e_deltas(data):
+    corte = _ultimo_corte(data)
+    fotos = dict(db.session.execute(
+        select(SaldoEstoque.produto_id, SaldoEstoque.saldo).join(corte, and_(
+            SaldoEstoque.produto_id == corte.c.produto_id, SaldoEstoque.data_corte == corte.c.data_corte
+        ))
+    ).all())
+    # Só os movimentos posteriores à foto de cada produto (índice produto_id, data)
+    deltas = dict(db.session.execute(
+        select(MovimentoEstoque.produto_id, func.sum(MovimentoEstoque.quantidade))
+        .outerjoin(corte, corte.c.produto_id == MovimentoEstoque.produto_id)
+        .where(
+            MovimentoEstoque.produto_id.isnot(None),
+            MovimentoEstoque.data <= data,
+            or_(corte.c.data_corte.is_(None), MovimentoEstoque.data > corte.c.data_corte)
+        ).group_by(MovimentoEstoque.produto_id)
+    ).all())
+    return fotos, deltas
+
+def saldos_em(data):
+    """Saldo de cada produto ao final de `data` (datetime UTC). Retorna {produto_id: saldo}."""
+    fotos, deltas = _fotos_e_deltas(data)
+    return {pid: fotos.get(pid, 0.0) + deltas.get(pid, 0.0) for pid in set(fotos) | set(deltas)}
+
+def saldos_no_fim_do_dia(dia):
+    """Saldos ao final do dia local `dia` (date): o fim do dia no fuso do servidor é convertido
+    para UTC, que é como os movimentos são carimbados."""
+    fim_local = datetime.combine(dia, time.max).astimezone()
+    return saldos_em(fim_local.astimezone(timezone.utc).replace(tzinfo=None))
+
+def compactar_estoque(data_corte=None):
+    """
+    Grava a foto do saldo no corte (padrão: último início de dia UTC, respeitando FOLGA_CORTE) para os
+    produtos que tiveram movimento desde a foto anterior. Idempotente. Retorna quantas fotos foram criadas.
+    """
+    corte = data_corte or datetime.combine((datetime.utcnow() - FOLGA_CORTE).date(), time.min)
+    try:
+        fotos, deltas = _fotos_e_deltas(corte)
+        novas = [
+            dict(produto_id=pid, data_corte=corte, saldo=fotos.get(pid, 0.0) + delta)
+            for pid, delta in deltas.items()
+        ]
+        if not novas:
+            return 0
+
+        dialeto = db.engine.dialect.name
+        if dialeto == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert as insert_dialeto
+        elif dialeto == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert as insert_dialeto
+        else:
+            insert_dialeto = None
+        # Outro processo pode ter gravado o mesmo corte: conflito ignorado
+        stmt = insert_dialeto(SaldoEstoque).on_conflict_do_nothing() if insert_dialeto else insert(SaldoEstoque)
+        db.session.execute(stmt, novas)
+        db.session.commit()
+        return len(novas)
+    except Exception as e:
+        db.session.rollback()
+        print(f"Erro ao compactar estoque: {e}")
+        return 0
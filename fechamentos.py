@@ -0,0 +1,148 @@
+import threading
+from sqlalchemy import text, insert
+from database import db, FechamentoMensal, ConfiguracaoFinanceira
+from ciclo_financeiro import obter_ciclo_atual, get_mes_anterior, get_proximo_mes, limites_ciclo
+from relatorios import totais_ciclo
+from estoque import compactar_estoque
+
+# ---------------------------
+# MOTOR DE FECHAMENTO MENSAL (fora do caminho das requisições)
+# ---------------------------
+
+# Chave da trava consultiva do Postgres que serializa o fechamento entre processos/workers
+CHAVE_TRAVA_FECHAMENTO = 20260204
+
+def obter_ultimo_fechamento():
+    return FechamentoMensal.query.order_by(FechamentoMensal.mes_ano.desc()).first()
+
+def encadear_acumulados(fechamento, anterior):
+    """Preenche os saldos acumulados de um fechamento a partir do fechamento imediatamente anterior."""
+    lucro_ant = anterior.lucro_acumulado if anterior and anterior.lucro_acumulado is not None else 0.0
+    retiradas_ant = anterior.retiradas_acumuladas if anterior and anterior.retiradas_acumuladas is not None else 0.0
+    fechamento.lucro_acumulado = lucro_ant + (fechamento.lucro_real or 0.0)
+    fechamento.retiradas_acumuladas = retiradas_ant + (fechamento.retiradas_extras or 0.0)
+
+def meses_pendentes(ultimo_mes, mes_alvo):
+    """Lista em ordem os meses ('AAAA-MM') após ultimo_mes até mes_alvo, inclusive."""
+    if ultimo_mes is None:
+        # Sem histórico não há ponto de partida: fecha apenas o último ciclo encerrado
+        return [mes_alvo]
+
+    meses = []
+    ano, mes = map(int, ultimo_mes.split('-'))
+    while True:
+        ano, mes = get_proximo_mes(ano, mes)
+        mes_str = f"{ano}-{mes:02d}"
+        if mes_str > mes_alvo:
+            break
+        meses.append(mes_str)
+    return meses
+
+def _adquirir_trava():
+    # No Postgres usa trava consultiva de transação (liberada no commit/rollback); nos demais bancos o upsert basta
+    if db.engine.dialect.name == 'postgresql':
+        return db.session.execute(text("SELECT pg_try_advisory_xact_lock(:chave)"), {'chave': CHAVE_TRAVA_FECHAMENTO}).scalar()
+    return True
+
+def _inserir_fechamento(valores):
+    """Insere o fechamento ignorando conflito de mes_ano. Retorna True se a linha foi criada por este processo."""
+    dialeto = db.engine.dialect.name
+    if dialeto == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as insert_dialeto
+    elif dialeto == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as insert_dialeto
+    else:
+        insert_dialeto = None
+
+    if insert_dialeto is not None:
+        stmt = insert_dialeto(FechamentoMensal).values(**valores).on_conflict_do_nothing(index_elements=['mes_ano'])
+    else:
+        stmt = insert(FechamentoMensal).values(**valores)
+    return db.session.execute(stmt).rowcount == 1
+
+def calcular_fechamento(mes_ano, config, fechamento_anterior):
+    ano, mes = map(int, mes_ano.split('-'))
+    inicio_ciclo, fim_ciclo = limites_ciclo(ano, mes)
+
+    totais = totais_ciclo(inicio_ciclo, fim_ciclo)
+    fat_liq = totais['faturamento_liquido']
+    custo_prod = totais['custo_produtos']
+    custo_var_extras = totais['gastos_extras']
+
+    custos_fixos_base = config.aluguel_iptu + config.pro_labore + config.agua_energia_base + config.internet_telefone + config.mei_impostos + config.marketing + config.seguro if config else 0
+
+    # O déficit só transita se o fechamento anterior for exatamente o mês imediatamente anterior
+    mes_ant_str = "{}-{:02d}".format(*get_mes_anterior(ano, mes))
+    if fechamento_anterior and fechamento_anterior.mes_ano == mes_ant_str and fechamento_anterior.deficit_acumulado < 0:
+        deficit_ant = abs(fechamento_anterior.deficit_acumulado)
+    else:
+        deficit_ant = 0
+
+    custos_totais = custos_fixos_base + custo_prod + custo_var_extras + deficit_ant
+    lucro_real = fat_liq - custos_totais
+    novo_deficit = lucro_real if lucro_real < 0 else 0
+
+    fechamento = FechamentoMensal(
+        mes_ano=mes_ano,
+        total_faturado=fat_liq,
+        custos_totais=custos_totais,
+        lucro_real=lucro_real,
+        deficit_acumulado=novo_deficit,
+        retiradas_extras=0.0 # Inicializa com zero
+    )
+    encadear_acumulados(fechamento, fechamento_anterior)
+    return fechamento
+
+def processar_fechamentos_pendentes(data_ref=None):
+    """
+    Gera, em ordem cronológica, todos os fechamentos ausentes até o último ciclo encerrado.
+    Idempotente: pode rodar em paralelo (CLI, agendador, vários workers) sem duplicar meses.
+    Retorna a lista de meses efetivamente fechados.
+    """
+    fechados = []
+    try:
+        _, _, _, mes_alvo = obter_ciclo_atual(data_ref)
+        ultimo = obter_ultimo_fechamento()
+        if ultimo and ultimo.mes_ano >= mes_alvo:
+            return fechados
+
+        if not _adquirir_trava():
+            return fechados
+
+        # Direto do banco: os valores do fechamento ficam gravados
+        config = ConfiguracaoFinanceira.query.first()
+        anterior = ultimo
+        for mes_ano in meses_pendentes(ultimo.mes_ano if ultimo else None, mes_alvo):
+            fechamento = calcular_fechamento(mes_ano, config, anterior)
+            valores = {col.name: getattr(fechamento, col.name) for col in FechamentoMensal.__table__.columns if col.name not in ('id', 'data_fechamento')}
+            if not _inserir_fechamento(valores):
+                # Outro processo fechou este mês antes: encerra sem sobrescrever
+                break
+            fechados.append(mes_ano)
+            anterior = fechamento
+
+        db.session.commit()
+        if fechados:
+            print(f"--- Fechamentos gerados: {', '.join(fechados)} ---")
+    except Exception as e:
+        db.session.rollback()
+        fechados = []
+        print(f"Erro ao processar fechamentos pendentes: {e}")
+    return fechados
+
+def iniciar_agendador_fechamentos(app, intervalo_minutos):
+    """Roda o motor de fechamento (e a foto diária do estoque) periodicamente em uma thread daemon do próprio processo.
+    A primeira rodada é logo na partida, fora do caminho do boot."""
+    parar = threading.Event()
+
+    def ciclo():
+        while True:
+            with app.app_context():
+                processar_fechamentos_pendentes()
+                compactar_estoque()
+                db.session.remove()
+            if parar.wait(intervalo_minutos * 60):
+                break
+
+    threading.Thread(target=ciclo, name='agendador-fechamentos', daemon=True).start()
+    return parar
@@ -0,0 +1,106 @@
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import update, or_, and_
+from database import db, MidiaAgendamento
+from midias import processar_midia
+from armazenamento import obter_armazenamento
+
+# ---------------------------
+# FILA DE PÓS-PROCESSAMENTO DE MÍDIA
+# ---------------------------
+# O upload só grava os bytes (já sem EXIF) e registra a mídia como 'pendente'. Miniaturas e
+# poster de vídeo rodam em um pool de threads. O status fica no banco: quem reserva uma mídia
+# grava o horário, e só reservas mais antigas que o prazo (worker morto no meio) são retomadas.
+
+STATUS_PENDENTE = 'pendente'
+STATUS_PROCESSANDO = 'processando'
+STATUS_CONCLUIDO = 'concluido'
+STATUS_ERRO = 'erro'
+
+PRAZO_PROCESSAMENTO = timedelta(minutes=15)
+
+class FilaMidias:
+    def __init__(self):
+        self._app = None
+        self._executor = None
+
+    def iniciar(self, app, workers):
+        """Com workers = 0 (ex: serverless) o processamento acontece na própria requisição."""
+        self._app = app
+        if workers > 0:
+            self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='midias')
+
+    def enfileirar(self, midia_id):
+        if self._executor:
+            self._executor.submit(self._executar, midia_id)
+        else:
+            processar_midia_pendente(midia_id)
+
+    def _executar(self, midia_id):
+        with self._app.app_context():
+            try:
+                processar_midia_pendente(midia_id)
+            finally:
+                db.session.remove()
+
+    def retomar_pendentes(self):
+        """Reenfileira pendentes e reservas vencidas (deve rodar com app context). Sem workers não faz nada:
+        a requisição não drena a fila, use `flask processar-midias`."""
+        if not self._executor:
+            return 0
+        ids = ids_disponiveis()
+        for midia_id in ids:
+            self.enfileirar(midia_id)
+        return len(ids)
+
+fila_midias = FilaMidias()
+
+def _disponivel(agora):
+    # Pendente, ou 'processando' reservada há mais que o prazo (ou antes de o horário ser gravado)
+    vencida = or_(
+        MidiaAgendamento.processamento_iniciado_em.is_(None),
+        MidiaAgendamento.processamento_iniciado_em < agora - PRAZO_PROCESSAMENTO
+    )
+    return or_(
+        MidiaAgendamento.status_processamento == STATUS_PENDENTE,
+        and_(MidiaAgendamento.status_processamento == STATUS_PROCESSANDO, vencida)
+    )
+
+def ids_disponiveis():
+    return db.session.scalars(
+        db.select(MidiaAgendamento.id).where(_disponivel(datetime.utcnow())).order_by(MidiaAgendamento.id)
+    ).all()
+
+def _reservar(midia_id):
+    # UPDATE condicional: só um worker (ou processo) assume cada mídia
+    agora = datetime.utcnow()
+    resultado = db.session.execute(
+        update(MidiaAgendamento)
+        .where(MidiaAgendamento.id == midia_id, _disponivel(agora))
+        .values(status_processamento=STATUS_PROCESSANDO, processamento_iniciado_em=agora)
+    )
+    db.session.commit()
+    return resultado.rowcount == 1
+
+def processar_midia_pendente(midia_id):
+    if not _reservar(midia_id):
+        return
+    midia = db.session.get(MidiaAgendamento, midia_id)
+    if midia is None: # Excluída enquanto aguardava na fila
+        return
+    try:
+        processar_midia(midia, obter_armazenamento())
+        midia.status_processamento = STATUS_CONCLUIDO
+    except Exception as e:
+        print(f"Erro ao processar mídia {midia_id}: {e}")
+        db.session.rollback()
+        midia = db.session.get(MidiaAgendamento, midia_id)
+        midia.status_processamento = STATUS_ERRO
+    db.session.commit()
+
+def processar_pendentes():
+    """Processa na thread atual tudo o que está disponível na fila. Retorna quantas mídias foram vistas."""
+    ids = ids_disponiveis()
+    for midia_id in ids:
+        processar_midia_pendente(midia_id)
+    return len(ids)
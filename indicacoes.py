@@ -0,0 +1,61 @@
+from sqlalchemy import func, update
+from database import db, Cliente, IndicacaoArvore
+
+# ---------------------------
+# INDICAÇÕES (árvore de indicado_por_id)
+# ---------------------------
+# indicacao_arvore guarda todos os pares ancestral/descendente, então a subárvore inteira de um
+# cliente (com profundidade e faturamento) sai de uma consulta indexada por ancestral_id, sem
+# percorrer padrinho/indicacoes recursivamente. Novos clientes entram na árvore pelo evento
+# after_insert de Cliente (database.py).
+
+def registrar_primeira_lavagem(cliente):
+    """Na primeira lavagem concluída do cliente, credita um desconto ao padrinho (uma vez só)."""
+    # UPDATE condicional: lavagens concluídas ao mesmo tempo não creditam duas vezes
+    resultado = db.session.execute(
+        update(Cliente)
+        .where(Cliente.id == cliente.id, Cliente.primeira_lavagem_concluida.isnot(True))
+        .values(primeira_lavagem_concluida=True)
+    )
+    if resultado.rowcount == 1 and cliente.indicado_por_id:
+        db.session.execute(
+            update(Cliente).where(Cliente.id == cliente.indicado_por_id)
+            .values(qtd_descontos=func.coalesce(Cliente.qtd_descontos, 0) + 1)
+        )
+        return True
+    return False
+
+def subarvore_indicacoes(cliente_id):
+    """Todos os indicados diretos e indiretos, por profundidade: [(Cliente, profundidade)]."""
+    return db.session.query(Cliente, IndicacaoArvore.profundidade).join(
+        IndicacaoArvore, IndicacaoArvore.descendente_id == Cliente.id
+    ).filter(
+        IndicacaoArvore.ancestral_id == cliente_id, IndicacaoArvore.profundidade > 0
+    ).order_by(IndicacaoArvore.profundidade, Cliente.nome).all()
+
+def resumo_indicacoes(clientes_ids):
+    """{cliente_id: (qtd_indicados, profundidade_maxima, faturamento_gerado)} para os clientes informados."""
+    if not clientes_ids:
+        return {}
+    linhas = db.session.query(
+        IndicacaoArvore.ancestral_id,
+        func.count(IndicacaoArvore.descendente_id),
+        func.max(IndicacaoArvore.profundidade),
+        func.coalesce(func.sum(Cliente.total_gasto), 0.0)
+    ).join(Cliente, Cliente.id == IndicacaoArvore.descendente_id).filter(
+        IndicacaoArvore.ancestral_id.in_(clientes_ids), IndicacaoArvore.profundidade > 0
+    ).group_by(IndicacaoArvore.ancestral_id).all()
+    return {ancestral: (qtd, profundidade, faturamento) for ancestral, qtd, profundidade, faturamento in linhas}
+
+def montar_arvore(pares):
+    """Linhas da tabela de fechamento a partir de [(cliente_id, indicado_por_id)] (usado na migração).
+    Padrinhos inexistentes ou ciclos cortam a cadeia em vez de travar."""
+    padrinho_de = dict(pares)
+    linhas = []
+    for cliente_id in padrinho_de:
+        atual, profundidade, vistos = cliente_id, 0, set()
+        while atual is not None and atual in padrinho_de and atual not in vistos:
+            vistos.add(atual)
+            linhas.append({'ancestral_id': atual, 'descendente_id': cliente_id, 'profundidade': profundidade})
+            atual, profundidade = padrinho_de[atual], profundidade + 1
+    return linhas
@@ -0,0 +1,219 @@
+import os
+import shutil
+import hashlib
+import tempfile
+import subprocess
+from database import MidiaAgendamento
+
+try:
+    from PIL import Image, ImageOps
+except ImportError: # Sem Pillow os uploads continuam aceitos, apenas sem miniatura/versão web
+    Image = None
+
+# ---------------------------
+# PIPELINE DE UPLOAD DE MÍDIA
+# ---------------------------
+
+TAMANHO_BLOCO = 64 * 1024
+TAMANHO_MINIATURA = (320, 320)
+TAMANHO_WEB = (1280, 1280)
+QUALIDADE_MINIATURA = 70
+QUALIDADE_WEB = 80
+
+# Marcas de 'ftyp' (ISO BMFF) que são imagens HEIF/HEIC; as demais são vídeo (mp4, mov, 3gp...)
+MARCAS_HEIF = {b'heic', b'heix', b'hevc', b'mif1', b'msf1'}
+ORIENTACAO_EXIF = 0x0112
+
+class UploadInvalido(ValueError):
+    pass
+
+def detectar_tipo(cabecalho):
+    """Identifica o arquivo pelos bytes iniciais. Retorna (tipo, extensão) ou (None, None)."""
+    if cabecalho.startswith(b'\xff\xd8\xff'):
+        return 'foto', 'jpg'
+    if cabecalho.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'foto', 'png'
+    if cabecalho[:6] in (b'GIF87a', b'GIF89a'):
+        return 'foto', 'gif'
+    if cabecalho[:4] == b'RIFF' and cabecalho[8:12] == b'WEBP':
+        return 'foto', 'webp'
+    if cabecalho[4:8] == b'ftyp':
+        if cabecalho[8:12] in MARCAS_HEIF:
+            return 'foto', 'heic'
+        return 'video', 'mov' if cabecalho[8:12] == b'qt  ' else 'mp4'
+    if cabecalho.startswith(b'\x1a\x45\xdf\xa3'):
+        return 'video', 'webm'
+    return None, None
+
+def salvar_em_blocos(stream, destino, limite_bytes=None):
+    """Copia o stream para o disco em blocos, sem carregar o arquivo inteiro na memória. Retorna (tamanho, sha256)."""
+    tamanho = 0
+    resumo = hashlib.sha256()
+    with open(destino, 'wb') as saida:
+        while True:
+            bloco = stream.read(TAMANHO_BLOCO)
+            if not bloco:
+                break
+            tamanho += len(bloco)
+            if limite_bytes and tamanho > limite_bytes:
+                saida.close()
+                os.remove(destino)
+                raise UploadInvalido('Arquivo maior que o limite permitido.')
+            resumo.update(bloco)
+            saida.write(bloco)
+    return tamanho, resumo.hexdigest()
+
+def _gravar_derivado(imagem, tamanho, destino, qualidade):
+    copia = imagem.copy()
+    copia.thumbnail(tamanho)
+    # JPEG salvo sem o parâmetro exif: metadados (GPS, câmera) não vão para os derivados
+    copia.save(destino, 'JPEG', quality=qualidade, optimize=True, progressive=True)
+
+def gerar_derivados(pasta, nome_original):
+    """Gera miniatura e versão web em JPEG ao lado do original. Retorna (miniatura, web) ou (None, None)."""
+    if Image is None:
+        return None, None
+    base = os.path.splitext(nome_original)[0]
+    nome_miniatura = f"{base}_mini.jpg"
+    nome_web = f"{base}_web.jpg"
+    try:
+        with Image.open(os.path.join(pasta, nome_original)) as imagem:
+            imagem = ImageOps.exif_transpose(imagem)
+            if imagem.mode not in ('RGB', 'L'):
+                imagem = imagem.convert('RGB')
+            _gravar_derivado(imagem, TAMANHO_MINIATURA, os.path.join(pasta, nome_miniatura), QUALIDADE_MINIATURA)
+            _gravar_derivado(imagem, TAMANHO_WEB, os.path.join(pasta, nome_web), QUALIDADE_WEB)
+    except Exception as e:
+        # Formato não suportado pelo Pillow (ex: HEIC sem plugin): mantém só o original
+        print(f"Erro ao gerar derivados de {nome_original}: {e}")
+        return None, None
+    return nome_miniatura, nome_web
+
+def _segmento_orientacao(dados_exif):
+    # Novo bloco APP1 só com a orientação: a foto continua de pé sem levar GPS/câmera junto
+    try:
+        exif = Image.Exif()
+        exif.load(dados_exif)
+        orientacao = exif.get(ORIENTACAO_EXIF)
+    except Exception:
+        return b''
+    if orientacao in (None, 1):
+        return b''
+    limpa = Image.Exif()
+    limpa[ORIENTACAO_EXIF] = orientacao
+    corpo = limpa.tobytes()
+    return b'\xff\xe1' + (len(corpo) + 2).to_bytes(2, 'big') + corpo
+
+def remover_exif_jpeg(origem, destino):
+    """Copia o JPEG sem os blocos EXIF/XMP (GPS, câmera), mantendo só a orientação e sem recomprimir.
+    Retorna o sha256 da cópia, ou None se não havia metadados a remover."""
+    if Image is None:
+        return None
+    with open(origem, 'rb') as entrada:
+        if entrada.read(2) != b'\xff\xd8':
+            return None
+        segmentos, removeu = [], False
+        # Percorre só os cabeçalhos até o início da imagem (SOS); o resto é copiado em blocos
+        while True:
+            marcador = entrada.read(2)
+            if len(marcador) < 2 or marcador[0] != 0xFF or marcador[1] in (0xD8, 0xD9, 0xFF):
+                return None # Estrutura inesperada: mantém o arquivo como veio
+            if marcador[1] == 0xDA:
+                break
+            tamanho = entrada.read(2)
+            dados = entrada.read(int.from_bytes(tamanho, 'big') - 2)
+            if marcador[1] == 0xE1 and dados.startswith(b'Exif\x00\x00'):
+                segmentos.append(_segmento_orientacao(dados))
+                removeu = True
+            elif marcador[1] == 0xE1 and dados.startswith(b'http://ns.adobe.com/xap/1.0/\x00'):
+                removeu = True
+            else:
+                segmentos.append(marcador + tamanho + dados)
+        if not removeu:
+            return None
+
+        resumo = hashlib.sha256()
+        with open(destino, 'wb') as saida:
+            for bloco in [b'\xff\xd8', *segmentos, marcador]:
+                resumo.update(bloco)
+                saida.write(bloco)
+            while True:
+                bloco = entrada.read(TAMANHO_BLOCO)
+                if not bloco:
+                    break
+                resumo.update(bloco)
+                saida.write(bloco)
+    return resumo.hexdigest()
+
+def extrair_poster_video(pasta, nome_video):
+    """Extrai um quadro do vídeo com ffmpeg (se instalado). Retorna o nome do JPEG ou None."""
+    ffmpeg = shutil.which('ffmpeg')
+    if not ffmpeg:
+        return None
+    nome_poster = f"{os.path.splitext(nome_video)[0]}_poster.jpg"
+    comando = [ffmpeg, '-y', '-loglevel', 'error', '-ss', '1', '-i', os.path.join(pasta, nome_video),
+               '-frames:v', '1', os.path.join(pasta, nome_poster)]
+    try:
+        subprocess.run(comando, check=True, timeout=60)
+    except (subprocess.SubprocessError, OSError) as e:
+        print(f"Erro ao extrair poster de {nome_video}: {e}")
+        return None
+    return nome_poster if os.path.exists(os.path.join(pasta, nome_poster)) else None
+
+def processar_midia(midia, armazenamento):
+    """Pós-processamento pesado de uma mídia já armazenada (executado fora da requisição)."""
+    original = midia.caminho_arquivo
+    with tempfile.TemporaryDirectory() as pasta:
+        armazenamento.baixar(original, os.path.join(pasta, original))
+        if midia.tipo == 'foto':
+            miniatura, web = gerar_derivados(pasta, original)
+        else:
+            poster = extrair_poster_video(pasta, original)
+            miniatura, web = gerar_derivados(pasta, poster) if poster else (None, None)
+        for nome in (miniatura, web):
+            if nome:
+                armazenamento.salvar(nome, os.path.join(pasta, nome))
+    midia.caminho_miniatura, midia.caminho_web = miniatura, web
+
+def salvar_upload_midia(arquivo, agendamento_id, armazenamento, limite_bytes=None):
+    """Valida, grava e armazena um upload pelo hash do conteúdo. Retorna a MidiaAgendamento (não commitada)."""
+    cabecalho = arquivo.stream.read(16)
+    tipo, extensao = detectar_tipo(cabecalho)
+    if not tipo:
+        raise UploadInvalido('Tipo de arquivo não suportado. Envie fotos (JPG, PNG, WEBP, HEIC) ou vídeos (MP4, MOV, WEBM).')
+    arquivo.stream.seek(0)
+
+    descritor, temporario = tempfile.mkstemp(suffix=f".{extensao}")
+    os.close(descritor)
+    limpo = f"{temporario}.limpo"
+    try:
+        tamanho, resumo = salvar_em_blocos(arquivo.stream, temporario, limite_bytes)
+        if extensao == 'jpg':
+            # EXIF sai antes do hash: a chave sempre corresponde aos bytes guardados
+            resumo_limpo = remover_exif_jpeg(temporario, limpo)
+            if resumo_limpo:
+                os.replace(limpo, temporario)
+                tamanho, resumo = os.path.getsize(temporario), resumo_limpo
+        chave = f"{resumo}.{extensao}"
+        # Mesmo conteúdo, mesma chave: reenvios não ocupam espaço de novo. Um blob gravado nunca é sobrescrito
+        if not armazenamento.existe(chave):
+            armazenamento.salvar(chave, temporario)
+    finally:
+        for caminho in (temporario, limpo):
+            if os.path.exists(caminho):
+                os.remove(caminho)
+
+    midia = MidiaAgendamento(
+        agendamento_id=agendamento_id,
+        caminho_arquivo=chave,
+        tamanho_bytes=tamanho,
+        tipo=tipo,
+        status_processamento='pendente'
+    )
+    # Derivados de um upload idêntico já processado são reaproveitados
+    existente = MidiaAgendamento.query.filter_by(caminho_arquivo=chave, status_processamento='concluido').first()
+    if existente:
+        midia.caminho_miniatura = existente.caminho_miniatura
+        midia.caminho_web = existente.caminho_web
+        midia.status_processamento = 'concluido'
+    return midia
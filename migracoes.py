@@ -0,0 +1,235 @@
+from datetime import datetime
+from sqlalchemy import text, inspect, insert, select, update, bindparam, func
+from database import db, SchemaVersao, Cliente, Agendamento, Moto, EstatisticaDuracao, IndicacaoArvore, normalizar_texto, apenas_digitos
+from busca_clientes import criar_indices_busca
+from duracoes import calcular_estatisticas
+from agregados_clientes import consulta_agregados_reais
+from indicacoes import montar_arvore
+
+# ---------------------------
+# MIGRAÇÕES VERSIONADAS DO BANCO
+# ---------------------------
+# Cada migração roda uma única vez e fica registrada em schema_versao.
+# Novas alterações de schema entram no FIM da lista MIGRACOES com o próximo número.
+
+def _adicionar_colunas(conn, colunas_existentes, tabela, colunas):
+    existentes = colunas_existentes.setdefault(tabela, set())
+    for col, tipo in colunas:
+        if col not in existentes:
+            conn.execute(text(f"ALTER TABLE {tabela} ADD COLUMN {col} {tipo}"))
+            existentes.add(col)
+
+def nomes_indices_existentes(conn):
+    # Consulta única ao catálogo (o inspector não reflete índices de expressão no SQLite)
+    if conn.dialect.name == 'postgresql':
+        return set(conn.execute(text("SELECT indexname FROM pg_indexes WHERE schemaname = current_schema()")).scalars())
+    if conn.dialect.name == 'sqlite':
+        return set(conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'index'")).scalars())
+    inspetor = inspect(conn)
+    return {ix['name'] for tabela in inspetor.get_table_names() for ix in inspetor.get_indexes(tabela)}
+
+def criar_indices_faltantes(conn, colunas):
+    # create_all só cria índices junto com tabelas novas. Índices de colunas que uma migração
+    # posterior ainda vai adicionar ficam para ela (que chama esta função de novo).
+    existentes = nomes_indices_existentes(conn)
+    for tabela in db.metadata.sorted_tables:
+        for indice in tabela.indexes:
+            if indice.name in existentes:
+                continue
+            if not all(col.name in colunas.get(tabela.name, ()) for col in indice.columns):
+                continue
+            indice.create(bind=conn)
+            existentes.add(indice.name)
+
+# --- Migrações ---
+
+def m001_clientes_crm(conn, colunas):
+    _adicionar_colunas(conn, colunas, 'clientes', [
+        ("qtd_descontos", "INTEGER DEFAULT 0"),
+        ("preferencias", "TEXT"),
+        ("feedback_texto", "TEXT"),
+        ("feedback_estrelas", "INTEGER DEFAULT 0"),
+        ("indicado_por_id", "INTEGER")
+    ])
+
+def m002_produtos_link_compra(conn, colunas):
+    _adicionar_colunas(conn, colunas, 'produtos', [("link_compra", "TEXT")])
+
+def m003_agendamentos_pagamento(conn, colunas):
+    _adicionar_colunas(conn, colunas, 'agendamentos', [
+        ("forma_pagamento_prevista", "VARCHAR(50)"),
+        ("forma_pagamento_real", "VARCHAR(50)"),
+        ("parcelas", "INTEGER DEFAULT 1"),
+        ("taxa_aplicada", "FLOAT DEFAULT 0.0"),
+        ("valor_liquido", "FLOAT")
+    ])
+
+def m004_configuracao_patrimonial(conn, colunas):
+    _adicionar_colunas(conn, colunas, 'configuracao_financeira', [
+        ("aporte_erick", "FLOAT DEFAULT 0.0"),
+        ("aporte_andrei", "FLOAT DEFAULT 0.0"),
+        ("capex_produtos", "FLOAT DEFAULT 0.0"),
+        ("capex_ferramentas", "FLOAT DEFAULT 0.0"),
+        ("capex_estrutura", "FLOAT DEFAULT 0.0"),
+        ("capex_marketing", "FLOAT DEFAULT 0.0"),
+        ("capex_outros", "FLOAT DEFAULT 0.0")
+    ])
+
+def m005_fechamento_retiradas(conn, colunas):
+    _adicionar_colunas(conn, colunas, 'fechamento_mensal', [("retiradas_extras", "FLOAT DEFAULT 0.0")])
+
+def m006_servicos_descricao(conn, colunas):
+    _adicionar_colunas(conn, colunas, 'servicos', [("descricao", "TEXT")])
+
+def m007_fechamento_acumulados(conn, colunas):
+    _adicionar_colunas(conn, colunas, 'fechamento_mensal', [
+        ("lucro_acumulado", "FLOAT"),
+        ("retiradas_acumuladas", "FLOAT")
+    ])
+    # Preenche a cadeia de saldos dos fechamentos já existentes
+    lucro = retiradas = 0.0
+    fechamentos = conn.execute(text("SELECT id, lucro_real, retiradas_extras FROM fechamento_mensal ORDER BY mes_ano")).all()
+    for id_, lucro_real, retiradas_extras in fechamentos:
+        lucro += lucro_real or 0.0
+        retiradas += retiradas_extras or 0.0
+        conn.execute(text("UPDATE fechamento_mensal SET lucro_acumulado = :l, retiradas_acumuladas = :r WHERE id = :id"),
+                     {'l': lucro, 'r': retiradas, 'id': id_})
+
+def m008_indices(conn, colunas):
+    criar_indices_faltantes(conn, colunas)
+
+def m009_clientes_busca_normalizada(conn, colunas):
+    _adicionar_colunas(conn, colunas, 'clientes', [
+        ("nome_busca", "VARCHAR(100)"),
+        ("telefone_digitos", "VARCHAR(20)")
+    ])
+    clientes = conn.execute(text("SELECT id, nome, telefone FROM clientes")).all()
+    if clientes:
+        conn.execute(text("UPDATE clientes SET nome_busca = :n, telefone_digitos = :t WHERE id = :id"),
+                     [{'n': normalizar_texto(nome), 't': apenas_digitos(tel), 'id': id_} for id_, nome, tel in clientes])
+    criar_indices_faltantes(conn, colunas)
+    criar_indices_busca(conn)
+
+def m010_midia_derivados(conn, colunas):
+    _adicionar_colunas(conn, colunas, 'midia_agendamento', [
+        ("caminho_miniatura", "VARCHAR(300)"),
+        ("caminho_web", "VARCHAR(300)"),
+        ("tamanho_bytes", "INTEGER")
+    ])
+
+def m011_midia_status_processamento(conn, colunas):
+    # Mídias já existentes foram processadas no próprio upload
+    _adicionar_colunas(conn, colunas, 'midia_agendamento', [("status_processamento", "VARCHAR(15) DEFAULT 'concluido'")])
+    criar_indices_faltantes(conn, colunas)
+
+def m012_midia_indice_conteudo(conn, colunas):
+    criar_indices_faltantes(conn, colunas)
+
+def m013_estoque_saldo_inicial(conn, colunas):
+    # A tabela é criada pelo create_all; o saldo atual vira o primeiro lançamento do livro-razão
+    conn.execute(text(
+        "INSERT INTO movimento_estoque (produto_id, tipo, quantidade, data) "
+        "SELECT id, 'saldo_inicial', estoque_atual, :agora FROM produtos WHERE estoque_atual IS NOT NULL AND estoque_atual <> 0"
+    ), {'agora': datetime.utcnow()})
+
+def m014_configuracao_agenda(conn, colunas):
+    _adicionar_colunas(conn, colunas, 'configuracao_financeira', [
+        ("boxes_lavagem", "INTEGER DEFAULT 1"),
+        ("horario_abertura", "VARCHAR(5) DEFAULT '08:00'"),
+        ("horario_fechamento", "VARCHAR(5) DEFAULT '18:00'"),
+        ("intervalo_slots_minutos", "INTEGER DEFAULT 30"),
+        ("duracao_padrao_minutos", "INTEGER DEFAULT 60")
+    ])
+
+def m015_estatisticas_duracao(conn, colunas):
+    # A tabela é criada pelo create_all; daqui em diante ela é mantida a cada lavagem concluída
+    # select tipado: o SQLite devolveria as datas como texto numa consulta crua
+    lavagens = conn.execute(
+        select(Agendamento.tipo_servico, Moto.categoria, Agendamento.tempo_inicio, Agendamento.tempo_fim)
+        .outerjoin(Moto, Moto.id == Agendamento.moto_id)
+        .where(Agendamento.tempo_inicio.isnot(None), Agendamento.tempo_fim.isnot(None))
+    ).all()
+    linhas = calcular_estatisticas(lavagens)
+    if linhas:
+        conn.execute(insert(EstatisticaDuracao), linhas)
+
+def m016_clientes_agregados(conn, colunas):
+    _adicionar_colunas(conn, colunas, 'clientes', [
+        ("qtd_lavagens", "INTEGER DEFAULT 0"),
+        ("qtd_canceladas", "INTEGER DEFAULT 0"),
+        ("total_gasto", "FLOAT DEFAULT 0.0"),
+        ("ultima_visita", "TIMESTAMP")
+    ])
+    agregados = conn.execute(consulta_agregados_reais()).all()
+    if agregados:
+        # update tipado: as datas são gravadas no formato do dialeto
+        tabela = Cliente.__table__
+        conn.execute(
+            update(tabela).where(tabela.c.id == bindparam('id_')),
+            [{'id_': id_, 'qtd_lavagens': l or 0, 'qtd_canceladas': c or 0, 'total_gasto': g or 0.0, 'ultima_visita': u}
+             for id_, l, c, g, u in agregados]
+        )
+    criar_indices_faltantes(conn, colunas)
+
+def m017_clientes_arvore_indicacoes(conn, colunas):
+    _adicionar_colunas(conn, colunas, 'clientes', [("primeira_lavagem_concluida", "BOOLEAN DEFAULT FALSE")])
+    # Quem já tem lavagem concluída já gerou (ou não precisava gerar) o desconto do padrinho
+    conn.execute(text(
+        "UPDATE clientes SET primeira_lavagem_concluida = TRUE WHERE EXISTS ("
+        "SELECT 1 FROM agendamentos a WHERE a.cliente_id = clientes.id AND a.status IN ('Lavagem Concluída', 'Retirado'))"
+    ))
+    # A tabela é criada pelo create_all; a árvore existente é montada em memória e gravada de uma vez
+    linhas = montar_arvore(conn.execute(text("SELECT id, indicado_por_id FROM clientes")).all())
+    if linhas:
+        conn.execute(insert(IndicacaoArvore), linhas)
+
+def m018_midia_reserva_processamento(conn, colunas):
+    _adicionar_colunas(conn, colunas, 'midia_agendamento', [("processamento_iniciado_em", "TIMESTAMP")])
+
+MIGRACOES = [
+    (1, 'Clientes: descontos, CRM e indicação', m001_clientes_crm),
+    (2, 'Produtos: link de compra', m002_produtos_link_compra),
+    (3, 'Agendamentos: forma de pagamento e valor líquido', m003_agendamentos_pagamento),
+    (4, 'Configuração: aportes e CAPEX', m004_configuracao_patrimonial),
+    (5, 'Fechamento: retiradas extras', m005_fechamento_retiradas),
+    (6, 'Serviços: descrição', m006_servicos_descricao),
+    (7, 'Fechamento: saldos acumulados', m007_fechamento_acumulados),
+    (8, 'Índices compostos das consultas principais', m008_indices),
+    (9, 'Clientes: busca normalizada e indexada', m009_clientes_busca_normalizada),
+    (10, 'Mídia: miniatura e versão web', m010_midia_derivados),
+    (11, 'Mídia: status do processamento em segundo plano', m011_midia_status_processamento),
+    (12, 'Mídia: índice da chave de conteúdo (deduplicação)', m012_midia_indice_conteudo),
+    (13, 'Estoque: saldo inicial no livro de movimentos', m013_estoque_saldo_inicial),
+    (14, 'Configuração: boxes e horário de funcionamento da agenda', m014_configuracao_agenda),
+    (15, 'Agenda: estatísticas de duração dos serviços', m015_estatisticas_duracao),
+    (16, 'Clientes: agregados de lavagens e gasto', m016_clientes_agregados),
+    (17, 'Clientes: árvore de indicações', m017_clientes_arvore_indicacoes),
+    (18, 'Mídia: horário da reserva do processamento', m018_midia_reserva_processamento),
+]
+
+def mapear_colunas(conn):
+    """Colunas existentes de todas as tabelas, obtidas em uma única chamada ao inspector."""
+    inspetor = inspect(conn)
+    return {tabela: {c['name'] for c in cols} for (_, tabela), cols in inspetor.get_multi_columns().items()}
+
+def aplicar_migracoes():
+    """Executa, em ordem, somente as migrações ainda não registradas. Com o schema em dia custa uma consulta."""
+    try:
+        with db.engine.connect() as conn:
+            versao_atual = conn.execute(db.select(func.max(SchemaVersao.versao))).scalar() or 0
+
+        pendentes = [m for m in MIGRACOES if m[0] > versao_atual]
+        if not pendentes:
+            return
+
+        with db.engine.connect() as conn:
+            colunas = mapear_colunas(conn)
+
+        for versao, descricao, migracao in pendentes:
+            # Cada passo e seu registro de versão vão na mesma transação
+            with db.engine.begin() as conn:
+                migracao(conn, colunas)
+                conn.execute(insert(SchemaVersao).values(versao=versao, descricao=descricao))
+            print(f"--- Migração {versao:03d} aplicada: {descricao} ---")
+    except Exception as e:
+        print(f"Erro ao aplicar migrações: {e}")
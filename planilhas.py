@@ -0,0 +1,509 @@
+import csv
+import io
+import os
+from datetime import datetime, date, time
+from sqlalchemy import insert, update
+from sqlalchemy.orm import aliased
+from database import db, STATUS_CONCLUIDOS, Cliente, Moto, Agendamento, IndicacaoArvore, normalizar_texto, apenas_digitos
+from cache_catalogo import consultar_servicos, servicos_por_nome
+from agregados_clientes import somar_agendamentos_importados
+from relatorios import consulta_dre, linha_dre
+
+try:
+    import openpyxl
+except ImportError: # Só é necessário para importar .xlsx
+    openpyxl = None
+
+# ---------------------------
+# IMPORTAÇÃO E EXPORTAÇÃO EM MASSA (CSV / XLSX)
+# ---------------------------
+# A planilha é lida linha a linha e gravada em lotes: cada lote valida as linhas, resolve
+# telefones/placas com uma consulta por lote e insere tudo em um único executemany. Linhas com
+# problema não interrompem a importação: entram no relatório de erros com o número da linha.
+# As exportações são geradores (yield_per), enviados ao navegador enquanto o banco é lido.
+
+TAMANHO_LOTE = 500
+STATUS_VALIDOS = ('Agendado', 'Em Lavagem', 'Lavagem Concluída', 'Retirado', 'Cancelado')
+
+COLUNAS_CLIENTES = ['nome', 'telefone', 'endereco', 'indicado_por_telefone', 'preferencias',
+                    'qtd_lavagens', 'qtd_canceladas', 'total_gasto', 'ultima_visita']
+COLUNAS_MOTOS = ['telefone', 'modelo', 'marca', 'placa', 'categoria', 'observacoes']
+COLUNAS_AGENDAMENTOS = ['telefone', 'placa', 'data', 'hora', 'servico', 'valor', 'status',
+                        'forma_pagamento', 'parcelas', 'gastos_extras']
+COLUNAS_DRE = ['data', 'cliente', 'moto', 'valor_cobrado', 'forma_pagamento', 'valor_recebido',
+               'gasto_produtos', 'despesas_variaveis', 'margem_contribuicao']
+
+class PlanilhaInvalida(ValueError):
+    pass
+
+class ResultadoImportacao:
+    __slots__ = ('importados', 'erros')
+
+    def __init__(self):
+        self.importados = 0
+        self.erros = [] # [(numero_linha, mensagem)]
+
+    def erro(self, numero, mensagem):
+        self.erros.append((numero, mensagem))
+
+# --- Leitura ---
+
+def _chave_coluna(nome):
+    # 'Endereço' -> 'endereco', 'Indicado por telefone' -> 'indicado_por_telefone'
+    return normalizar_texto(str(nome or '')).replace(' ', '_')
+
+def _linhas_csv(arquivo):
+    texto = io.TextIOWrapper(arquivo, encoding='utf-8-sig', newline='')
+    amostra = texto.read(4096)
+    texto.seek(0)
+    try:
+        dialeto = csv.Sniffer().sniff(amostra, delimiters=';,\t')
+    except csv.Error:
+        dialeto = 'excel'
+    leitor = csv.reader(texto, dialeto)
+    cabecalho = [_chave_coluna(c) for c in next(leitor, [])]
+    for numero, valores in enumerate(leitor, start=2):
+        if any(v.strip() for v in valores):
+            yield numero, dict(zip(cabecalho, valores))
+
+def _linhas_xlsx(arquivo):
+    if openpyxl is None:
+        raise PlanilhaInvalida('Importar .xlsx requer o pacote openpyxl (ou salve a planilha como CSV).')
+    # read_only: as linhas vêm do arquivo sob demanda, sem montar a planilha inteira em memória
+    pasta = openpyxl.load_workbook(arquivo, read_only=True, data_only=True)
+    try:
+        linhas = pasta.active.iter_rows(values_only=True)
+        cabecalho = [_chave_coluna(c) for c in next(linhas, ())]
+        for numero, valores in enumerate(linhas, start=2):
+            if any(v not in (None, '') for v in valores):
+                yield numero, dict(zip(cabecalho, valores))
+    finally:
+        pasta.close()
+
+def ler_planilha(arquivo, nome_arquivo):
+    """Gera (numero_linha, {coluna: valor}) de um upload .csv ou .xlsx."""
+    extensao = os.path.splitext(nome_arquivo or '')[1].lower()
+    if extensao == '.csv':
+        return _linhas_csv(arquivo)
+    if extensao in ('.xlsx', '.xlsm'):
+        return _linhas_xlsx(arquivo)
+    raise PlanilhaInvalida('Formato não suportado: envie um arquivo .csv ou .xlsx.')
+
+def _em_lotes(linhas, tamanho=TAMANHO_LOTE):
+    lote = []
+    for linha in linhas:
+        lote.append(linha)
+        if len(lote) >= tamanho:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+# --- Conversão de células ---
+
+def _texto(valor):
+    if valor is None:
+        return ''
+    if isinstance(valor, float) and valor.is_integer(): # Telefones numéricos no Excel
+        valor = int(valor)
+    return str(valor).strip()
+
+def _numero(valor):
+    if isinstance(valor, (int, float)):
+        return float(valor)
+    texto = _texto(valor).replace('R$', '').replace(' ', '')
+    if not texto:
+        return None
+    if ',' in texto: # Formato brasileiro: 1.234,56
+        texto = texto.replace('.', '').replace(',', '.')
+    return float(texto)
+
+def _data_hora(valor_data, valor_hora):
+    if isinstance(valor_data, datetime):
+        data = valor_data
+    elif isinstance(valor_data, date):
+        data = datetime.combine(valor_data, datetime.min.time())
+    else:
+        texto = _texto(valor_data)
+        for formato in ('%d/%m/%Y %H:%M', '%d/%m/%Y', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d'):
+            try:
+                data = datetime.strptime(texto, formato)
+                break
+            except ValueError:
+                continue
+        else:
+            raise ValueError(texto)
+
+    if isinstance(valor_hora, time):
+        return datetime.combine(data.date(), valor_hora)
+    hora = _texto(valor_hora)
+    if hora:
+        return datetime.combine(data.date(), datetime.strptime(hora[:5], '%H:%M').time())
+    return data
+
+def _placa(valor):
+    return _texto(valor).upper().replace('-', '').replace(' ', '')
+
+def _campo_longo(*campos):
+    # Postgres recusa texto maior que a coluna e derrubaria o lote inteiro: vira erro da linha
+    for nome, valor, limite in campos:
+        if valor and len(valor) > limite:
+            return f'{nome} passa de {limite} caracteres'
+    return None
+
+def _ids_por_telefone(digitos):
+    if not digitos:
+        return {}
+    return dict(db.session.query(Cliente.telefone_digitos, Cliente.id).filter(Cliente.telefone_digitos.in_(set(digitos))).all())
+
+# --- Importação: clientes ---
+
+def importar_clientes(linhas):
+    resultado = ResultadoImportacao()
+    for lote in _em_lotes(linhas):
+        _importar_lote_clientes(lote, resultado)
+        db.session.commit()
+    return resultado
+
+def _importar_lote_clientes(lote, resultado):
+    candidatos = []
+    for numero, linha in lote:
+        nome = _texto(linha.get('nome'))
+        telefone = _texto(linha.get('telefone'))
+        if not nome or not apenas_digitos(telefone):
+            resultado.erro(numero, 'nome e telefone são obrigatórios')
+            continue
+        longo = _campo_longo(('nome', nome, 100), ('telefone', telefone, 20), ('endereco', _texto(linha.get('endereco')), 200))
+        if longo:
+            resultado.erro(numero, longo)
+            continue
+        candidatos.append((numero, linha, nome, telefone, apenas_digitos(telefone)))
+
+    padrinhos = [apenas_digitos(_texto(c[1].get('indicado_por_telefone'))) for c in candidatos]
+    existentes = _ids_por_telefone([c[4] for c in candidatos] + [p for p in padrinhos if p])
+
+    novos, vistos = [], set()
+    for numero, linha, nome, telefone, digitos in candidatos:
+        if digitos in existentes:
+            resultado.erro(numero, f'telefone {telefone} já cadastrado')
+        elif digitos in vistos:
+            resultado.erro(numero, f'telefone {telefone} repetido no arquivo')
+        else:
+            vistos.add(digitos)
+            novos.append((numero, linha, nome, telefone, digitos))
+    if not novos:
+        return
+
+    # Insert em massa não passa pelos eventos do ORM: campos de busca e agregados vão preenchidos aqui
+    agora = datetime.utcnow()
+    inseridos = db.session.execute(insert(Cliente).returning(Cliente.id, Cliente.telefone_digitos), [{
+        'nome': nome,
+        'telefone': telefone,
+        'endereco': _texto(linha.get('endereco')) or None,
+        'preferencias': _texto(linha.get('preferencias')) or None,
+        'nome_busca': normalizar_texto(nome),
+        'telefone_digitos': digitos,
+        'data_cadastro': agora,
+        'qtd_descontos': 0,
+        'feedback_estrelas': 0,
+        'qtd_lavagens': 0,
+        'qtd_canceladas': 0,
+        'total_gasto': 0.0,
+        'primeira_lavagem_concluida': False
+    } for _, linha, nome, telefone, digitos in novos]).all()
+    ids = dict((digitos, id_) for id_, digitos in inseridos)
+    resultado.importados += len(ids)
+
+    # Padrinhos: já cadastrados ou em linhas anteriores do mesmo lote/arquivo
+    id_por_telefone = {**existentes, **ids}
+    padrinho_de = {}
+    for numero, linha, _, _, digitos in novos:
+        telefone_padrinho = apenas_digitos(_texto(linha.get('indicado_por_telefone')))
+        if not telefone_padrinho:
+            continue
+        padrinho_id = id_por_telefone.get(telefone_padrinho)
+        if padrinho_id and padrinho_id != ids[digitos]:
+            padrinho_de[ids[digitos]] = padrinho_id
+        else:
+            resultado.erro(numero, 'padrinho não encontrado; cliente importado sem indicação')
+    linha_de = {ids[digitos]: numero for numero, _, _, _, digitos in novos}
+    for cliente_id in _quebrar_ciclos(padrinho_de, set(ids.values())):
+        resultado.erro(linha_de[cliente_id], 'indicação circular; cliente importado sem indicação')
+
+    # Só o vínculo: indicações do histórico não geram descontos novos
+    if padrinho_de:
+        db.session.execute(update(Cliente), [
+            {'id': cliente_id, 'indicado_por_id': padrinho_id} for cliente_id, padrinho_id in padrinho_de.items()
+        ])
+    _ligar_na_arvore(list(ids.values()), padrinho_de)
+
+def _quebrar_ciclos(padrinho_de, novos_ids):
+    # Dois clientes novos indicando um ao outro: a indicação do primeiro da cadeia é descartada
+    removidos = []
+    for cliente_id in list(padrinho_de):
+        atual, vistos = padrinho_de.get(cliente_id), {cliente_id}
+        while atual in novos_ids and atual in padrinho_de and atual not in vistos:
+            vistos.add(atual)
+            atual = padrinho_de[atual]
+        if atual == cliente_id:
+            del padrinho_de[cliente_id]
+            removidos.append(cliente_id)
+    return removidos
+
+def _ligar_na_arvore(novos_ids, padrinho_de):
+    """Linhas da tabela de fechamento (indicacao_arvore) dos clientes inseridos em massa."""
+    novos = set(novos_ids)
+    externos = {p for p in padrinho_de.values() if p not in novos}
+    ancestrais = {}
+    if externos:
+        for ancestral_id, descendente_id, profundidade in db.session.query(
+            IndicacaoArvore.ancestral_id, IndicacaoArvore.descendente_id, IndicacaoArvore.profundidade
+        ).filter(IndicacaoArvore.descendente_id.in_(externos)):
+            ancestrais.setdefault(descendente_id, []).append((ancestral_id, profundidade))
+
+    def cadeia(cliente_id):
+        if cliente_id not in ancestrais:
+            if cliente_id not in novos: # Cliente antigo sem linhas na árvore
+                return [(cliente_id, 0)]
+            padrinho_id = padrinho_de.get(cliente_id)
+            ancestrais[cliente_id] = [(cliente_id, 0)] + (
+                [(a, p + 1) for a, p in cadeia(padrinho_id)] if padrinho_id else []
+            )
+        return ancestrais[cliente_id]
+
+    linhas = [{'ancestral_id': a, 'descendente_id': cliente_id, 'profundidade': p}
+              for cliente_id in novos_ids for a, p in cadeia(cliente_id)]
+    if linhas:
+        db.session.execute(insert(IndicacaoArvore), linhas)
+
+# --- Importação: motos ---
+
+def importar_motos(linhas):
+    resultado = ResultadoImportacao()
+    for lote in _em_lotes(linhas):
+        _importar_lote_motos(lote, resultado)
+        db.session.commit()
+    return resultado
+
+def _importar_lote_motos(lote, resultado):
+    clientes = _ids_por_telefone([apenas_digitos(_texto(l.get('telefone'))) for _, l in lote])
+    placas_existentes = {
+        (cliente_id, _placa(placa)) for cliente_id, placa in db.session.query(Moto.cliente_id, Moto.placa).filter(
+            Moto.cliente_id.in_(set(clientes.values())), Moto.placa.isnot(None)
+        )
+    } if clientes else set()
+
+    novas = []
+    for numero, linha in lote:
+        cliente_id = clientes.get(apenas_digitos(_texto(linha.get('telefone'))))
+        modelo = _texto(linha.get('modelo'))
+        placa = _placa(linha.get('placa'))
+        categoria = _texto(linha.get('categoria'))
+        longo = _campo_longo(('categoria', categoria, 20))
+        if not cliente_id:
+            resultado.erro(numero, f'cliente com telefone "{_texto(linha.get("telefone"))}" não encontrado')
+        elif not modelo:
+            resultado.erro(numero, 'modelo é obrigatório')
+        elif len(placa) > 10:
+            resultado.erro(numero, f'placa inválida: "{placa}"')
+        elif longo:
+            resultado.erro(numero, longo)
+        elif placa and (cliente_id, placa) in placas_existentes:
+            resultado.erro(numero, f'placa {placa} já cadastrada para este cliente')
+        else:
+            if placa:
+                placas_existentes.add((cliente_id, placa))
+            novas.append({
+                'cliente_id': cliente_id,
+                'modelo': modelo[:50],
+                'marca': _texto(linha.get('marca'))[:50] or None,
+                'placa': placa or None,
+                'categoria': categoria or 'Naked',
+                'observacoes': _texto(linha.get('observacoes'))[:200] or None
+            })
+    if novas:
+        db.session.execute(insert(Moto), novas)
+        resultado.importados += len(novas)
+
+# --- Importação: agendamentos ---
+
+def importar_agendamentos(linhas):
+    """Histórico de serviços. Sem status, datas passadas entram como 'Retirado' e futuras como 'Agendado'.
+    Não dá baixa de estoque nem confere boxes: são lavagens que já aconteceram (ou já combinadas)."""
+    resultado = ResultadoImportacao()
+    # Custos de receita gravados nos agendamentos: lidos do banco uma vez, não do cache do processo
+    receitas = servicos_por_nome(consultar_servicos())
+    vistos = set() # (cliente, data/hora, serviço) já lidos neste arquivo
+    for lote in _em_lotes(linhas):
+        _importar_lote_agendamentos(lote, resultado, receitas, vistos)
+        db.session.commit()
+    return resultado
+
+def _existentes(novos):
+    """Chaves (cliente, data/hora, serviço) do lote que já estão no banco."""
+    if not novos:
+        return set()
+    datas = [a['data_agendada'] for a in novos]
+    return set(db.session.query(Agendamento.cliente_id, Agendamento.data_agendada, Agendamento.tipo_servico).filter(
+        Agendamento.cliente_id.in_({a['cliente_id'] for a in novos}),
+        Agendamento.data_agendada.between(min(datas), max(datas))
+    ).all())
+
+def _importar_lote_agendamentos(lote, resultado, receitas, vistos):
+    clientes = _ids_por_telefone([apenas_digitos(_texto(l.get('telefone'))) for _, l in lote])
+    motos_por_cliente = {}
+    if clientes:
+        for moto_id, cliente_id, placa in db.session.query(Moto.id, Moto.cliente_id, Moto.placa).filter(
+            Moto.cliente_id.in_(set(clientes.values()))
+        ).order_by(Moto.id):
+            motos_por_cliente.setdefault(cliente_id, []).append((moto_id, _placa(placa)))
+
+    hoje = datetime.combine(date.today(), datetime.min.time())
+    novos, linhas_validas = [], []
+    for numero, linha in lote:
+        cliente_id = clientes.get(apenas_digitos(_texto(linha.get('telefone'))))
+        if not cliente_id:
+            resultado.erro(numero, f'cliente com telefone "{_texto(linha.get("telefone"))}" não encontrado')
+            continue
+        motos = motos_por_cliente.get(cliente_id, [])
+        placa = _placa(linha.get('placa'))
+        moto_id = next((m for m, p in motos if p == placa), None) if placa else (motos[0][0] if len(motos) == 1 else None)
+        if not moto_id:
+            resultado.erro(numero, f'moto "{placa}" não encontrada para o cliente' if placa else 'informe a placa (cliente com nenhuma ou várias motos)')
+            continue
+        try:
+            data_agendada = _data_hora(linha.get('data'), linha.get('hora'))
+        except ValueError:
+            resultado.erro(numero, f'data/hora inválida: "{_texto(linha.get("data"))}" "{_texto(linha.get("hora"))}"')
+            continue
+        try:
+            valor = _numero(linha.get('valor'))
+            gastos_extras = _numero(linha.get('gastos_extras')) or 0.0
+            parcelas = int(_numero(linha.get('parcelas')) or 1)
+        except ValueError:
+            resultado.erro(numero, 'valor, parcelas ou gastos_extras não é um número')
+            continue
+        if valor is None:
+            resultado.erro(numero, 'valor é obrigatório')
+            continue
+        status = _texto(linha.get('status')) or ('Retirado' if data_agendada < hoje else 'Agendado')
+        if status not in STATUS_VALIDOS:
+            resultado.erro(numero, f'status inválido: "{status}"')
+            continue
+
+        servico = _texto(linha.get('servico'))[:50] or None
+        forma_pagamento = _texto(linha.get('forma_pagamento')) or None
+        longo = _campo_longo(('forma_pagamento', forma_pagamento, 50))
+        if longo:
+            resultado.erro(numero, longo)
+            continue
+        concluido = status in STATUS_CONCLUIDOS
+        receita = receitas.get(servico) if concluido and servico else None
+        linhas_validas.append(numero)
+        novos.append({
+            'cliente_id': cliente_id,
+            'moto_id': moto_id,
+            'data_agendada': data_agendada,
+            'status': status,
+            'tipo_servico': servico,
+            'valor_cobrado': valor,
+            'desconto_aplicado': False,
+            'custo_total_produtos': receita.custo_receita if receita else 0.0,
+            'gastos_extras': gastos_extras,
+            'forma_pagamento_prevista': forma_pagamento,
+            'forma_pagamento_real': forma_pagamento if concluido else None,
+            'parcelas': parcelas,
+            'taxa_aplicada': 0.0,
+            'valor_liquido': valor if concluido else None
+        })
+
+    # Reimportar a mesma planilha não duplica agendamentos (nem os agregados dos clientes)
+    existentes = _existentes(novos)
+    unicos = []
+    for numero, agendamento in zip(linhas_validas, novos):
+        chave = (agendamento['cliente_id'], agendamento['data_agendada'], agendamento['tipo_servico'])
+        if chave in existentes:
+            resultado.erro(numero, 'agendamento já cadastrado (mesmo cliente, data, hora e serviço)')
+        elif chave in vistos:
+            resultado.erro(numero, 'agendamento repetido no arquivo')
+        else:
+            vistos.add(chave)
+            unicos.append(agendamento)
+    novos = unicos
+
+    if novos:
+        db.session.execute(insert(Agendamento), novos)
+        somar_agendamentos_importados([(a['cliente_id'], a['status'], a['valor_cobrado'], a['data_agendada']) for a in novos])
+        # Histórico importado não gera desconto de indicação depois
+        concluiram = {a['cliente_id'] for a in novos if a['status'] in STATUS_CONCLUIDOS}
+        if concluiram:
+            db.session.execute(update(Cliente).where(Cliente.id.in_(concluiram)).values(primeira_lavagem_concluida=True))
+        resultado.importados += len(novos)
+
+IMPORTADORES = {
+    'clientes': importar_clientes,
+    'motos': importar_motos,
+    'agendamentos': importar_agendamentos
+}
+
+# --- Exportação ---
+
+def _decimal(valor):
+    return f"{valor or 0.0:.2f}".replace('.', ',')
+
+def _data(valor):
+    return valor.strftime('%d/%m/%Y') if valor else ''
+
+def gerar_csv(cabecalho, linhas, linhas_por_bloco=200):
+    """CSV em blocos (';' e BOM UTF-8 para abrir direto no Excel em português)."""
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer, delimiter=';')
+    buffer.write('\ufeff')
+    escritor.writerow(cabecalho)
+    for contador, linha in enumerate(linhas, start=1):
+        escritor.writerow(linha)
+        if contador % linhas_por_bloco == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+    yield buffer.getvalue()
+
+def linhas_clientes():
+    padrinho = aliased(Cliente)
+    consulta = db.session.query(
+        Cliente.nome, Cliente.telefone, Cliente.endereco, padrinho.telefone, Cliente.preferencias,
+        Cliente.qtd_lavagens, Cliente.qtd_canceladas, Cliente.total_gasto, Cliente.ultima_visita
+    ).outerjoin(padrinho, padrinho.id == Cliente.indicado_por_id).order_by(Cliente.nome, Cliente.id)
+    for nome, telefone, endereco, telefone_padrinho, preferencias, lavagens, canceladas, gasto, ultima in consulta.yield_per(TAMANHO_LOTE):
+        yield [nome, telefone, endereco or '', telefone_padrinho or '', preferencias or '',
+               lavagens or 0, canceladas or 0, _decimal(gasto), _data(ultima)]
+
+def linhas_motos():
+    consulta = db.session.query(
+        Cliente.telefone, Moto.modelo, Moto.marca, Moto.placa, Moto.categoria, Moto.observacoes
+    ).join(Cliente, Cliente.id == Moto.cliente_id).order_by(Cliente.nome, Moto.id)
+    for linha in consulta.yield_per(TAMANHO_LOTE):
+        yield [valor or '' for valor in linha]
+
+def linhas_agendamentos():
+    consulta = db.session.query(
+        Cliente.telefone, Moto.placa, Agendamento.data_agendada, Agendamento.tipo_servico, Agendamento.valor_cobrado,
+        Agendamento.status, Agendamento.forma_pagamento_real, Agendamento.forma_pagamento_prevista,
+        Agendamento.parcelas, Agendamento.gastos_extras
+    ).join(Cliente, Cliente.id == Agendamento.cliente_id).join(Moto, Moto.id == Agendamento.moto_id).order_by(Agendamento.data_agendada)
+    for telefone, placa, data, servico, valor, status, forma_real, forma_prevista, parcelas, gastos in consulta.yield_per(TAMANHO_LOTE):
+        yield [telefone, placa or '', _data(data), data.strftime('%H:%M'), servico or '', _decimal(valor), status,
+               forma_real or forma_prevista or '', parcelas or 1, _decimal(gastos)]
+
+def linhas_dre_csv(data_inicio, data_fim):
+    for l in consulta_dre(data_inicio, data_fim).yield_per(TAMANHO_LOTE):
+        item = linha_dre(l)
+        yield [_data(item['data']), item['cliente'], item['moto'], _decimal(item['valor_cobrado']), item['forma_pagamento'],
+               _decimal(item['valor_recebido']), _decimal(item['gasto_produtos']), _decimal(item['despesas_variaveis']),
+               _decimal(item['margem_contribuicao'])]
+
+EXPORTACOES = {
+    'clientes': (COLUNAS_CLIENTES, linhas_clientes),
+    'motos': (COLUNAS_MOTOS, linhas_motos),
+    'agendamentos': (COLUNAS_AGENDAMENTOS, linhas_agendamentos)
+}
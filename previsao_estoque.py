@@ -0,0 +1,128 @@
+import math
+from datetime import date, datetime, timedelta
+from sqlalchemy import func
+from database import db, STATUS_CONCLUIDOS, Produto, Agendamento, MovimentoEstoque
+from cache_catalogo import cache_catalogo
+
+# ---------------------------
+# PREVISÃO DE CONSUMO E RUPTURA DE ESTOQUE
+# ---------------------------
+# Consumo de cada dia futuro = o maior entre o agendado (receitas dos serviços marcados) e a
+# média diária recente do livro de movimentos. O saldo projetado dá a data em que cada produto
+# cruza o ponto de pedido ("pedir até") e a data em que acaba. Consumo histórico e agendado saem
+# agregados do banco; entre dois dias com agendamento acima da média o saldo cai em linha reta,
+# então o cruzamento é calculado por trecho, sem percorrer o horizonte dia a dia.
+
+HORIZONTE_DIAS = 45
+JANELA_HISTORICO_DIAS = 28
+ANTECEDENCIA_ALERTA_DIAS = 7
+
+class PrevisaoProduto:
+    __slots__ = ('produto_id', 'consumo_diario', 'data_pedido', 'data_ruptura')
+
+    def __init__(self, produto_id, consumo_diario, data_pedido, data_ruptura):
+        self.produto_id = produto_id
+        self.consumo_diario = consumo_diario # Média histórica (unidade do produto por dia)
+        self.data_pedido = data_pedido       # Saldo projetado <= ponto_pedido (None: além do horizonte)
+        self.data_ruptura = data_ruptura     # Saldo projetado <= 0 (None: além do horizonte)
+
+def _consumo_historico():
+    """Média diária de consumo por produto na janela, a partir do consumo agregado por produto e dia."""
+    inicio = datetime.utcnow() - timedelta(days=JANELA_HISTORICO_DIAS)
+    dia = func.date(MovimentoEstoque.data)
+    consumos_diarios = db.session.query(
+        MovimentoEstoque.produto_id, dia, func.sum(MovimentoEstoque.quantidade)
+    ).filter(
+        MovimentoEstoque.tipo == 'consumo', MovimentoEstoque.data >= inicio, MovimentoEstoque.produto_id.isnot(None)
+    ).group_by(MovimentoEstoque.produto_id, dia).all()
+    totais = {}
+    for pid, _, total in consumos_diarios:
+        totais[pid] = totais.get(pid, 0.0) - (total or 0.0)
+    # Dias sem consumo contam como zero: a média é sobre a janela inteira
+    return {pid: total / JANELA_HISTORICO_DIAS for pid, total in totais.items() if total}
+
+def _consumo_agendado(hoje, horizonte, doses):
+    """Dose agendada por produto e dia do horizonte (serviços ainda não realizados): {produto_id: {indice_dia: qtd}}."""
+    inicio = datetime.combine(hoje, datetime.min.time())
+    dia = func.date(Agendamento.data_agendada)
+    linhas = db.session.query(dia, Agendamento.tipo_servico, func.count(Agendamento.id)).filter(
+        Agendamento.data_agendada >= inicio,
+        Agendamento.data_agendada < inicio + timedelta(days=horizonte),
+        Agendamento.status.notin_(STATUS_CONCLUIDOS + ('Cancelado',))
+    ).group_by(dia, Agendamento.tipo_servico).all()
+
+    contagens = {} # {nome_servico: {indice_dia: qtd}}
+    for d, nome_servico, qtd in linhas:
+        # SQLite devolve a data como texto, Postgres como date
+        indice = (date.fromisoformat(str(d)[:10]) - hoje).days
+        if 0 <= indice < horizonte:
+            contagens.setdefault(nome_servico, {})[indice] = qtd
+
+    # Dose agendada do produto no dia = dose x serviços marcados que o usam. Produtos usados pelos
+    # mesmos serviços compartilham a contagem diária, somada uma vez por conjunto de serviços
+    servicos_do_produto = {}
+    for nome_servico in contagens:
+        servico = cache_catalogo.servico_por_nome(nome_servico)
+        for pid in (servico.produtos_ids if servico else ()):
+            servicos_do_produto.setdefault(pid, []).append(nome_servico)
+    por_conjunto = {}
+    agendado = {}
+    for pid, nomes in servicos_do_produto.items():
+        chave = tuple(nomes)
+        if chave not in por_conjunto:
+            total = {}
+            for nome_servico in nomes:
+                for indice, qtd in contagens[nome_servico].items():
+                    total[indice] = total.get(indice, 0) + qtd
+            por_conjunto[chave] = total
+        dose = doses.get(pid, 0.0)
+        agendado[pid] = {indice: qtd * dose for indice, qtd in por_conjunto[chave].items()}
+    return agendado
+
+def _primeiro_dia(alvo, media, excedentes, horizonte):
+    """Primeiro dia em que o consumo acumulado chega a `alvo`. O consumo do dia i é media + o excedente
+    agendado nele (max(agendado - media, 0)), então entre dois excedentes o acumulado é uma reta."""
+    if alvo <= 0:
+        return 0
+    extra = 0.0
+    inicio = 0
+    for dia, excedente in sorted(excedentes.items()) + [(horizonte, 0.0)]:
+        # Trecho [inicio, dia - 1] com extra constante: acumulado(i) = media * (i + 1) + extra
+        if dia > inicio:
+            if extra >= alvo - media * (inicio + 1):
+                return inicio
+            if media > 0:
+                candidato = max(inicio, math.ceil((alvo - extra) / media) - 1)
+                if candidato < dia:
+                    return candidato
+        extra += excedente
+        inicio = dia
+    return None
+
+def prever_estoque(hoje=None, horizonte=HORIZONTE_DIAS):
+    """Projeta todos os produtos de uma vez. Retorna {produto_id: PrevisaoProduto}."""
+    hoje = hoje or date.today()
+    produtos = db.session.query(Produto.id, Produto.estoque_atual, Produto.ponto_pedido, Produto.gasto_medio_lavagem).all()
+    taxa = _consumo_historico()
+    agendado = _consumo_agendado(hoje, horizonte, {pid: dose or 0.0 for pid, _, _, dose in produtos})
+
+    previsoes = {}
+    for pid, estoque, ponto_pedido, _ in produtos:
+        saldo = estoque or 0.0
+        ponto = ponto_pedido or 0.0
+        media = taxa.get(pid, 0.0)
+        excedentes = {dia: qtd - media for dia, qtd in agendado.get(pid, {}).items() if qtd > media}
+        dia_pedido = _primeiro_dia(saldo - ponto, media, excedentes, horizonte)
+        dia_ruptura = _primeiro_dia(saldo, media, excedentes, horizonte)
+        previsoes[pid] = PrevisaoProduto(
+            pid, media,
+            hoje + timedelta(days=dia_pedido) if dia_pedido is not None else None,
+            hoje + timedelta(days=dia_ruptura) if dia_ruptura is not None else None
+        )
+    return previsoes
+
+def alertas_reposicao(previsoes, hoje=None, antecedencia=ANTECEDENCIA_ALERTA_DIAS):
+    """Previsões cujo pedido precisa sair nos próximos dias, das mais urgentes para as menos."""
+    limite = (hoje or date.today()) + timedelta(days=antecedencia)
+    urgentes = [p for p in previsoes.values() if p.data_pedido and p.data_pedido <= limite]
+    return sorted(urgentes, key=lambda p: p.data_pedido)
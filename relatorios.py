@@ -0,0 +1,70 @@
+from datetime import datetime
+from sqlalchemy import func
+from database import db, STATUS_CONCLUIDOS, Cliente, Moto, Agendamento
+
+# ---------------------------
+# RELATÓRIOS FINANCEIROS (AGREGAÇÕES EM SQL)
+# ---------------------------
+
+# Valor efetivamente recebido: líquido de taxas quando informado, senão o valor cobrado
+valor_recebido_sql = func.coalesce(func.nullif(Agendamento.valor_liquido, 0), Agendamento.valor_cobrado)
+
+def filtro_concluidos_ciclo(data_inicio, data_fim):
+    return (
+        Agendamento.data_agendada >= datetime.combine(data_inicio, datetime.min.time()),
+        Agendamento.data_agendada <= datetime.combine(data_fim, datetime.max.time()),
+        Agendamento.status.in_(STATUS_CONCLUIDOS)
+    )
+
+def totais_ciclo(data_inicio, data_fim):
+    """Soma faturamento e custos variáveis dos serviços concluídos no ciclo em uma única consulta."""
+    linha = db.session.query(
+        func.count(Agendamento.id),
+        func.coalesce(func.sum(Agendamento.valor_cobrado), 0.0),
+        func.coalesce(func.sum(valor_recebido_sql), 0.0),
+        func.coalesce(func.sum(func.coalesce(Agendamento.custo_total_produtos, 0.0)), 0.0),
+        func.coalesce(func.sum(func.coalesce(Agendamento.gastos_extras, 0.0)), 0.0)
+    ).filter(*filtro_concluidos_ciclo(data_inicio, data_fim)).one()
+
+    quantidade, bruto, liquido, custo_produtos, gastos_extras = linha
+    return {
+        'quantidade': quantidade,
+        'faturamento_bruto': float(bruto),
+        'faturamento_liquido': float(liquido),
+        'custo_produtos': float(custo_produtos),
+        'gastos_extras': float(gastos_extras)
+    }
+
+def consulta_dre(data_inicio, data_fim):
+    """Projeção de colunas do DRE (sem carregar objetos ORM), ainda não executada."""
+    # outerjoin: agendamentos de moto/cliente removidos continuam no DRE, como em totais_ciclo
+    return db.session.query(
+        Agendamento.data_agendada,
+        Agendamento.valor_cobrado,
+        valor_recebido_sql.label('valor_recebido'),
+        func.coalesce(Agendamento.custo_total_produtos, 0.0).label('gasto_produtos'),
+        func.coalesce(Agendamento.gastos_extras, 0.0).label('despesas_variaveis'),
+        func.coalesce(func.nullif(Agendamento.forma_pagamento_real, ''), func.nullif(Agendamento.forma_pagamento_prevista, ''), 'PIX').label('forma_pagamento'),
+        Cliente.nome.label('cliente_nome'),
+        Moto.modelo.label('moto_modelo'),
+        Moto.placa.label('moto_placa')
+    ).outerjoin(Cliente, Cliente.id == Agendamento.cliente_id).outerjoin(Moto, Moto.id == Agendamento.moto_id).filter(
+        *filtro_concluidos_ciclo(data_inicio, data_fim)
+    ).order_by(Agendamento.data_agendada)
+
+def linha_dre(l):
+    return {
+        'cliente': l.cliente_nome or '',
+        'moto': f"{l.moto_modelo} ({l.moto_placa})" if l.moto_modelo is not None else '',
+        'data': l.data_agendada,
+        'valor_cobrado': l.valor_cobrado,
+        'forma_pagamento': l.forma_pagamento,
+        'valor_recebido': l.valor_recebido,
+        'gasto_produtos': l.gasto_produtos,
+        'despesas_variaveis': l.despesas_variaveis,
+        'margem_contribuicao': l.valor_recebido - l.gasto_produtos - l.despesas_variaveis
+    }
+
+def linhas_dre(data_inicio, data_fim):
+    """Monta as linhas do DRE a partir de uma projeção de colunas (sem carregar objetos ORM)."""
+    return [linha_dre(l) for l in consulta_dre(data_inicio, data_fim).all()]